@@ -24,17 +24,21 @@ class AppState(State):
 
 
 
+# Меню не меняется — замораживаем один раз: JSON кнопок собирается при первой отправке и дальше переиспользуется.
+MENU_KEYBOARD = (
+    Keyboard()
+    .row(
+        Keyboard.button("Имя", cmd="/ask_name"),
+        Keyboard.button("Справка", cmd="/help"),
+    )
+    .row(Keyboard.button("Клиенты", cmd="/clients"))
+    .freeze()
+)
+
+
 def menu_keyboard():
     """Клавиатура главного меню."""
-    return (
-        Keyboard()
-        .row(
-            Keyboard.button("Имя", cmd="/ask_name"),
-            Keyboard.button("Справка", cmd="/help"),
-        )
-        .row(Keyboard.button("Клиенты", cmd="/clients"))
-        .build()
-    )
+    return MENU_KEYBOARD
 
 menu_router = Router()
 
@@ -111,8 +115,15 @@ def clients_keyboard(clients, selected_ids):
     #     selected_ids,
     #     cancel_text=None,
     #     cancel_cmd=None,
-    # ).build()
-    return MultiSelectKeyboard(clients, selected_ids).build()
+    # )
+    # page_size — клиенты по 10 на страницу: при тысячах клиентов клавиатура остаётся маленькой.
+    return MultiSelectKeyboard(clients, selected_ids, page_size=10)
+
+
+def clients_picker(bot, login):
+    """MultiSelectKeyboard пользователя из state: живёт между нажатиями, счётчики не пересчитываются."""
+    return bot.state(login).get("clients_picker")
+
 
 @name_router.button_handler("clients")
 async def choose_clients(callback: CallbackQuery):
@@ -125,9 +136,21 @@ async def choose_clients(callback: CallbackQuery):
     clients = await get_clients()
     state = bot.state(login)
     state["clients_items"] = clients
-    state["selected_clients"] = []
+    state["clients_picker"] = clients_keyboard(clients, [])
     set_state(bot, login, AppState.choose_clients)
-    await bot.reply("Выберите клиентов:", clients_keyboard(clients, []))
+    await bot.reply("Выберите клиентов (или напишите начало названия для поиска):", state["clients_picker"].build())
+
+
+@name_router.message_handler(state=AppState.choose_clients)
+async def on_clients_search(message: Message):
+    bot = Bot.current()
+    if not bot:
+        return
+    picker = clients_picker(bot, bot.current_login())
+    if picker is None:
+        return
+    picker.set_query(message.text)
+    await bot.reply(f"Найдено страниц: {picker.pages}. Выберите клиентов:", picker.build())
 
 
 @name_router.callback_handler(filters=lambda _u, p: p.get("cmd") == "/ms_toggle")
@@ -135,17 +158,26 @@ async def on_clients_toggle(callback: CallbackQuery):
     bot = Bot.current()
     if not bot:
         return
-    login = bot.current_login()
-    if not login:
+    picker = clients_picker(bot, bot.current_login())
+    if picker is None:
         return
-    state = bot.state(login)
-    selected = set(state.get("selected_clients", []))
-    clients = state.get("clients_items", [])
     item_id = str(callback.payload.get("id", ""))
     if item_id:
-        selected.symmetric_difference_update({item_id})
-    state["selected_clients"] = list(selected)
-    await bot.reply("Выберите клиентов:", clients_keyboard(clients, state["selected_clients"]))
+        picker.toggle(item_id)
+    picker.set_page(callback.payload.get("page", 0))
+    await bot.reply("Выберите клиентов:", picker.build())
+
+
+@name_router.callback_handler(filters=lambda _u, p: p.get("cmd") == "/ms_page")
+async def on_clients_page(callback: CallbackQuery):
+    bot = Bot.current()
+    if not bot:
+        return
+    picker = clients_picker(bot, bot.current_login())
+    if picker is None:
+        return
+    picker.set_page(callback.payload.get("page", 0))
+    await bot.reply("Выберите клиентов:", picker.build())
 
 
 @name_router.callback_handler(filters=lambda _u, p: p.get("cmd") == "/ms_all")
@@ -153,15 +185,15 @@ async def on_clients_all(callback: CallbackQuery):
     bot = Bot.current()
     if not bot:
         return
-    login = bot.current_login()
-    if not login:
+    picker = clients_picker(bot, bot.current_login())
+    if picker is None:
         return
-    state = bot.state(login)
-    selected = set(state.get("selected_clients", []))
-    clients = state.get("clients_items", [])
-    all_ids = {item["id"] for item in clients}
-    state["selected_clients"] = [] if all_ids and selected == all_ids else list(all_ids)
-    await bot.reply("Выберите клиентов:", clients_keyboard(clients, state["selected_clients"]))
+    if picker.all_selected:
+        picker.clear_all()
+    else:
+        picker.select_all()
+    picker.set_page(callback.payload.get("page", 0))
+    await bot.reply("Выберите клиентов:", picker.build())
 
 
 @name_router.callback_handler(filters=lambda _u, p: p.get("cmd") == "/ms_done")
@@ -173,7 +205,8 @@ async def on_clients_done(callback: CallbackQuery):
     if not login:
         return
     state = bot.state(login)
-    selected = set(state.get("selected_clients", []))
+    picker = clients_picker(bot, login)
+    selected = set(picker.selected()) if picker is not None else set()
     clients = state.get("clients_items", [])
     # Показываем выбранные имена в стабильном порядке исходного списка.
     selected_names = [item["text"] for item in clients if item["id"] in selected]
@@ -21,16 +21,20 @@ class AppState(State):
     wait_name = "wait_name"
 
 
+# Меню не меняется — замораживаем один раз: JSON кнопок собирается при первой отправке и дальше переиспользуется.
+MENU_KEYBOARD = (
+    Keyboard()
+    .row(
+        Keyboard.button("Имя", cmd="/ask_name"),
+        Keyboard.button("Справка", cmd="/help"),
+    )
+    .freeze()
+)
+
+
 def menu_keyboard():
     """Клавиатура главного меню."""
-    return (
-        Keyboard()
-        .row(
-            Keyboard.button("Имя", cmd="/ask_name"),
-            Keyboard.button("Справка", cmd="/help"),
-        )
-        .build()
-    )
+    return MENU_KEYBOARD
 
 
 menu_router = Router()
@@ -2,25 +2,37 @@
 
 __version__ = "0.1.0"
 
+from .broadcast import BroadcastResult
 from .client import Bot
-from .filters import F, Filter, StateFilter, and_f, or_f
+from .codec import JsonCodec
+from .filters import F, Filter, StateFilter, StatePrefix, and_f, or_f
 from .fsm import FSMContext, State, clear_state, get_state, set_state
-from .keyboard import Keyboard, MultiSelectKeyboard
+from .keyboard import FrozenKeyboard, Keyboard, MultiSelectKeyboard
 from .router import Router
+from .storage import AsyncStorage, BaseStorage, CachedStorage, MemoryStorage, SQLiteStorage
 from .types import CallbackQuery, Message, User
 
 __all__ = [
+    "AsyncStorage",
+    "BaseStorage",
     "Bot",
+    "BroadcastResult",
+    "CachedStorage",
     "CallbackQuery",
     "F",
     "FSMContext",
     "Filter",
+    "FrozenKeyboard",
+    "JsonCodec",
     "Keyboard",
+    "MemoryStorage",
     "MultiSelectKeyboard",
     "Message",
     "Router",
+    "SQLiteStorage",
     "State",
     "StateFilter",
+    "StatePrefix",
     "User",
     "and_f",
     "clear_state",
@@ -0,0 +1,110 @@
+"""Рассылка одного текста многим login: общая часть тела запроса сериализуется один раз, получатели читаются потоком, результаты отдаются async-итератором — миллион получателей в памяти не держится."""
+
+import asyncio
+import inspect
+from typing import TYPE_CHECKING, Any, AsyncIterable, AsyncIterator, Callable, Dict, Iterable, Optional, Set, Union
+
+if TYPE_CHECKING:
+    from .client import Bot
+    from .codec import JsonCodec
+    from .keyboard import KeyboardLike
+
+
+class BroadcastResult:
+    """Итог отправки одному получателю: message_id при успехе, иначе error."""
+
+    __slots__ = ("login", "message_id", "error")
+
+    def __init__(self, login: str, message_id: Optional[int] = None, error: Optional[str] = None) -> None:
+        self.login = login
+        self.message_id = message_id
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self) -> str:
+        if self.ok:
+            return f"BroadcastResult(login={self.login!r}, message_id={self.message_id!r})"
+        return f"BroadcastResult(login={self.login!r}, error={self.error!r})"
+
+
+def _shared_tail(codec: "JsonCodec", text: str, keyboard_json: Optional[bytes]) -> bytes:
+    """Всё тело sendText, кроме login: ',"text":...}' — склеивается с login без повторной сериализации."""
+    tail = b',"text":' + codec.dumps(text)
+    if keyboard_json is not None:
+        tail += b',"inline_keyboard":' + keyboard_json
+    return tail + b"}"
+
+
+async def _iterate(logins: Union[Iterable[str], AsyncIterable[str]]) -> AsyncIterator[str]:
+    if hasattr(logins, "__aiter__"):
+        async for login in logins:  # type: ignore[union-attr]
+            yield login
+    else:
+        for login in logins:  # type: ignore[union-attr]
+            yield login
+
+
+async def broadcast(
+    bot: "Bot",
+    logins: Union[Iterable[str], AsyncIterable[str]],
+    text: str,
+    keyboard: Optional["KeyboardLike"] = None,
+    *,
+    concurrency: int = 32,
+    on_progress: Optional[Callable[[int, int], Any]] = None,
+    progress_every: int = 100,
+) -> AsyncIterator[BroadcastResult]:
+    """Реализация Bot.broadcast: в очереди отправки не больше concurrency сообщений рассылки, результаты — по мере завершения."""
+    if concurrency < 1:
+        raise ValueError("concurrency must be >= 1")
+    if progress_every < 1:
+        raise ValueError("progress_every must be >= 1")
+    codec = bot._codec
+    tail = _shared_tail(codec, text, bot._keyboard_json(keyboard))
+    in_flight: Dict["asyncio.Future[Any]", str] = {}
+    sent = failed = 0
+    source = _iterate(logins).__aiter__()
+    exhausted = False
+
+    async def progress() -> None:
+        if on_progress is not None:
+            res = on_progress(sent, failed)
+            if inspect.isawaitable(res):
+                await res
+
+    while True:
+        while not exhausted and len(in_flight) < concurrency:
+            try:
+                login = await source.__anext__()
+            except StopAsyncIteration:
+                exhausted = True
+                break
+            outbox = bot._outbox
+            if outbox is None:
+                failed += 1
+                yield BroadcastResult(login, error="bot is not running")
+                if (sent + failed) % progress_every == 0:
+                    await progress()
+                continue
+            body = b'{"login":' + codec.dumps(login) + tail
+            in_flight[outbox.enqueue(login, body, "broadcast")] = login
+        if not in_flight:
+            break
+        done: Set["asyncio.Future[Any]"]
+        done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+        for fut in done:
+            login = in_flight.pop(fut)
+            result = fut.result()
+            if result.status == 200:
+                sent += 1
+                yield BroadcastResult(login, message_id=result.message_id)
+            else:
+                failed += 1
+                yield BroadcastResult(login, error=f"{result.status}: {result.error}")
+            if (sent + failed) % progress_every == 0:
+                await progress()
+    if (sent + failed) % progress_every != 0:
+        await progress()
@@ -2,22 +2,48 @@
 
 import asyncio
 import contextvars
-import json
-from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Set
+import inspect
+from typing import TYPE_CHECKING, Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
 
 if TYPE_CHECKING:
+    from aiohttp import web
+
     from .router import Router
 
 import aiohttp
 from loguru import logger
 
-from .fsm import get_state
-from .keyboard import Keyboard
-from .middleware import Middleware
-from .types import CallbackQuery, Message
+from .handler_index import HandlerIndex, router_mark
+from .journal import UpdateJournal
+from .limits import HandlerLimits, HandlerTimeout, OnTimeout
+from .keyboard import FrozenKeyboard, Keyboard, KeyboardLike, flatten_rows
+from .broadcast import BroadcastResult, broadcast
+from .coalescer import EditCoalescer
+from .codec import JsonCodec, get_codec
+from .commands import CommandPattern
+from .dedup import SeenUpdates
+from .dispatcher import ShardedDispatcher, update_login
+from .executors import HandlerExecutors, check_executor
+from .middleware import Middleware, compile_chain
+from .outbox import Outbox, SendResult
+from .resilience import CircuitBreaker, RetryPolicy
+from .storage import BaseStorage, MemoryStorage, SQLiteStorage
+from .types import CallbackQuery, Message, ParsedUpdate, UserPool
 
 BASE_URL = "https://botapi.messenger.yandex.net/bot/v1"
 
+def _retry_after(headers: Any) -> Optional[float]:
+    """Retry-After в секундах; форма с датой и мусор — None."""
+    value = headers.get("Retry-After")
+    try:
+        return max(float(value), 0.0) if value is not None else None
+    except ValueError:
+        return None
+
+
+# Стартовая пауза adaptive backoff в конвейерном режиме; дальше удваивается до poll_idle_sleep.
+_POLL_BACKOFF_START = 0.05
+
 # Кто сейчас обрабатывается — чтобы reply() и Bot.current() работали без глобального bot.
 _current_login: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
     "current_login", default=None
@@ -37,17 +63,138 @@ class Bot:
         log: Optional[Any] = None,
         poll_active_sleep: float = 0.2,
         poll_idle_sleep: float = 1.0,
+        poll_limit: int = 10,
+        poll_pipeline: bool = False,
+        workers: int = 128,
+        intake_size: Optional[int] = 1024,
+        shed_after: Optional[float] = None,
+        shed_policy: str = "drop",
+        busy_text: str = "Сейчас много запросов, попробуйте чуть позже.",
+        journal_path: Optional[str] = None,
+        journal_flush_interval: float = 0.5,
+        dedup_size: Optional[int] = 10000,
+        dedup_path: Optional[str] = None,
+        dedup_save_interval: float = 5.0,
+        http_pool_size: int = 100,
+        http_pool_per_host: int = 0,
+        http_keepalive: float = 60.0,
+        http_dns_ttl: Optional[int] = 300,
+        http_compress: bool = True,
+        send_rate: Optional[float] = None,
+        send_burst: Optional[float] = None,
+        login_send_rate: Optional[float] = None,
+        login_send_burst: Optional[float] = None,
+        send_workers: int = 64,
+        retry_attempts: int = 4,
+        retry_base_delay: float = 0.5,
+        retry_max_delay: float = 30.0,
+        breaker_threshold: int = 5,
+        breaker_recovery: float = 30.0,
+        json_codec: Union[str, JsonCodec] = "auto",
+        edit_debounce: Optional[float] = None,
+        edit_max_latency: float = 1.0,
+        thread_workers: Optional[int] = None,
+        process_workers: Optional[int] = None,
+        storage: Optional[BaseStorage] = None,
+        storage_path: Optional[str] = None,
+        storage_flush_interval: float = 1.0,
+        state_max_entries: Optional[int] = None,
+        state_idle_ttl: Optional[float] = None,
     ) -> None:
-        """api_key — OAuth-токен. log — свой логгер. poll_active_sleep — пауза цикла, когда есть updates. poll_idle_sleep — пауза цикла, когда updates нет."""
+        """api_key — OAuth-токен. log — свой логгер. poll_active_sleep — пауза цикла, когда есть updates. poll_idle_sleep — пауза цикла, когда updates нет (в конвейерном режиме — потолок backoff). poll_limit — сколько updates просить за один getUpdates. poll_pipeline — конвейерный опрос: следующий getUpdates уходит сразу после передачи пачки, без фиксированных пауз. workers — число шардов-воркеров: updates одного login обрабатываются строго по порядку, разных — параллельно. intake_size — предел updates в работе: заполнен — опрос ждёт (None — без предела). shed_after — сколько секунд update может пролежать в очереди; дольше — по shed_policy: "drop" — выбросить, "busy" — ответить busy_text без хендлеров. journal_path — файл журнала входящих updates: незавершённые после падения обрабатываются при старте, offset продолжается с сохранённого. journal_flush_interval — период записи журнала на диск. dedup_size — сколько последних update_id помнить, чтобы не обработать повторную доставку дважды (None — не проверять). dedup_path — файл, где этот список переживает перезапуск и падение: пишется раз в dedup_save_interval секунд, если появились новые id, и при остановке. http_pool_size / http_pool_per_host — пул соединений для отправки (0 — без предела). http_keepalive — сколько секунд держать простаивающее соединение (тёплый TLS для рассылок). http_dns_ttl — кеш DNS в секундах (None — без кеша). http_compress — просить у API сжатые ответы. send_rate / send_burst — общий предел отправок в секунду и запас (None — без предела). login_send_rate / login_send_burst — то же на один login. send_workers — параллельных отправок. retry_attempts / retry_base_delay / retry_max_delay — попытки вызова API и экспоненциальная пауза с jitter между ними (Retry-After сервера учитывается). breaker_threshold — сбоев API подряд до размыкания circuit breaker, breaker_recovery — через сколько секунд пробовать снова (у опроса и у отправок breaker'ы отдельные, с этими настройками). json_codec — JSON для запросов, ответов, payload и журнала: "auto" (orjson, если установлен), "orjson", "json" или свой JsonCodec. edit_debounce — склеивать частые правки одного сообщения: уходит последняя после edit_debounce секунд тишины, но не позже edit_max_latency от первой (None — каждая правка сразу). thread_workers / process_workers — размеры пулов для def-хендлеров и executor="thread" / "process" (None — по умолчанию concurrent.futures); пулы создаются при первом таком хендлере. storage — где лежат FSM-состояния и bot.state(login) (по умолчанию — память, перезапуск их стирает). storage_path — то же в файле SQLite (SQLiteStorage): чтение из кеша в памяти, изменения пишутся пачкой раз в storage_flush_interval секунд и при остановке. state_max_entries / state_idle_ttl — сколько пользователей держать в памяти и сколько секунд без обращения (FSM и bot.state вместе); лишние и простоявшие вытесняются, давние первыми (None — без предела). С SQLite вытесненные остаются на диске, в памяти — теряются."""
         self.api_key = api_key
         self._log = log if log is not None else logger
         if poll_active_sleep < 0:
             raise ValueError("poll_active_sleep must be >= 0")
         if poll_idle_sleep < 0:
             raise ValueError("poll_idle_sleep must be >= 0")
+        if poll_limit < 1:
+            raise ValueError("poll_limit must be >= 1")
+        if workers < 1:
+            raise ValueError("workers must be >= 1")
+        if intake_size is not None and intake_size < 1:
+            raise ValueError("intake_size must be >= 1")
+        if shed_after is not None and shed_after <= 0:
+            raise ValueError("shed_after must be > 0")
+        if shed_policy not in ("drop", "busy"):
+            raise ValueError('shed_policy must be "drop" or "busy"')
         self._poll_active_sleep = float(poll_active_sleep)
         self._poll_idle_sleep = float(poll_idle_sleep)
-        self._session: Optional[aiohttp.ClientSession] = None
+        self._poll_limit = int(poll_limit)
+        self._poll_pipeline = bool(poll_pipeline)
+        self._workers = int(workers)
+        self._intake_size = intake_size
+        self._shed_after = shed_after
+        self._shed_policy = shed_policy
+        self._busy_text = busy_text
+        self._codec = get_codec(json_codec)
+        self._executors = HandlerExecutors(
+            self.reply, thread_workers=thread_workers, process_workers=process_workers
+        )
+        self._journal: Optional[UpdateJournal] = (
+            UpdateJournal(
+                journal_path, flush_interval=journal_flush_interval, log=self._log, codec=self._codec
+            )
+            if journal_path
+            else None
+        )
+        if storage is not None and storage_path:
+            raise ValueError("pass either storage or storage_path")
+        if storage is not None and (state_max_entries is not None or state_idle_ttl is not None):
+            raise ValueError("state_max_entries / state_idle_ttl are for the built-in storage; pass them to your storage")
+        if storage_path:
+            storage = SQLiteStorage(
+                storage_path,
+                flush_interval=storage_flush_interval,
+                max_entries=state_max_entries,
+                idle_ttl=state_idle_ttl,
+                codec=self._codec,
+                log=self._log,
+            )
+        elif storage is None:
+            storage = MemoryStorage(max_entries=state_max_entries, idle_ttl=state_idle_ttl, log=self._log)
+        self._storage: BaseStorage = storage
+        self._seen: Optional[SeenUpdates] = SeenUpdates(dedup_size) if dedup_size else None
+        self._dedup_path = dedup_path
+        if dedup_save_interval <= 0:
+            raise ValueError("dedup_save_interval must be > 0")
+        self._dedup_save_interval = float(dedup_save_interval)
+        self._dedup_saver: Optional[asyncio.Task] = None
+        if http_pool_size < 0 or http_pool_per_host < 0:
+            raise ValueError("http_pool_size and http_pool_per_host must be >= 0")
+        if http_keepalive < 0:
+            raise ValueError("http_keepalive must be >= 0")
+        self._http_pool_size = int(http_pool_size)
+        self._http_pool_per_host = int(http_pool_per_host)
+        self._http_keepalive = float(http_keepalive)
+        self._http_dns_ttl = http_dns_ttl
+        self._http_compress = bool(http_compress)
+        for name, value in (("send_rate", send_rate), ("login_send_rate", login_send_rate)):
+            if value is not None and value <= 0:
+                raise ValueError(f"{name} must be > 0")
+        if send_workers < 1:
+            raise ValueError("send_workers must be >= 1")
+        self._retry_policy = RetryPolicy(retry_attempts, retry_base_delay, retry_max_delay)
+        self._breaker = CircuitBreaker(breaker_threshold, breaker_recovery)
+        # у опроса свой: таймауты long poll не должны глушить отправку, а пробный getUpdates — держать её до 60 с
+        self._poll_breaker = CircuitBreaker(breaker_threshold, breaker_recovery)
+        self._outbox_options: Dict[str, Any] = {
+            "rate": send_rate,
+            "burst": send_burst,
+            "login_rate": login_send_rate,
+            "login_burst": login_send_burst,
+            "workers": send_workers,
+            "policy": self._retry_policy,
+            "breaker": self._breaker,
+        }
+        self._outbox: Optional[Outbox] = None
+        if edit_debounce is not None and (edit_debounce <= 0 or edit_max_latency < edit_debounce):
+            raise ValueError("edit_debounce must be > 0 and <= edit_max_latency")
+        self._edit_debounce = edit_debounce
+        self._edit_max_latency = float(edit_max_latency)
+        self._edits: Optional[EditCoalescer] = None
+        self._session: Optional[aiohttp.ClientSession] = None  # отправка
+        self._poll_session: Optional[aiohttp.ClientSession] = None  # только getUpdates
         self._last_update_id = 0
         self._running = False
 
@@ -56,10 +203,15 @@ class Bot:
         self._callback_handlers: List[Dict[str, Any]] = []
         self._default_handlers: List[Dict[str, Any]] = []
         self._middlewares: List[Middleware] = []
+        self._outer_middlewares: List[Middleware] = []
+        self._routers: List["Router"] = []
+        self._router_marks: List[Tuple[int, ...]] = []
+        self._index: Optional[HandlerIndex] = None
 
-        self._user_states: Dict[str, dict] = {}
-        self._fsm_states: Dict[str, str] = {}  # FSM по login; отдельно от state(login), чтобы не пересекаться с твоими ключами
-        self._pending_tasks: Set[asyncio.Task] = set()
+        self._users = UserPool()
+        self._dispatcher: Optional[ShardedDispatcher] = None
+        self._process_factory: Optional[tuple] = None  # (factory, processes) в run_multiprocess
+        self._stop_event: Optional[asyncio.Event] = None
 
     @staticmethod
     def current() -> Optional["Bot"]:
@@ -68,9 +220,12 @@ class Bot:
 
     def state(self, login: str) -> dict:
         """Словарь данных пользователя по login (свой для каждого). Туда — выбранные значения, email и т.п. FSM лежит отдельно в get_state/set_state."""
-        if login not in self._user_states:
-            self._user_states[login] = {}
-        return self._user_states[login]
+        return self._storage.data(login)
+
+    @property
+    def storage(self) -> BaseStorage:
+        """Хранилище FSM и bot.state. Вне хендлера с постоянным хранилищем — await bot.storage.prefetch(login) перед чтением."""
+        return self._storage
 
     def message_handler(
         self,
@@ -78,15 +233,56 @@ class Bot:
         *,
         filters: Optional[Callable[[Dict], bool]] = None,
         state: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+        on_timeout: OnTimeout = None,
+        executor: Optional[str] = None,
     ) -> Callable:
-        """Вешает обработчик на текст. text — команда вроде "/start" или None на любое. filters — доп. проверка по update. state — только в этом FSM-состоянии. Вернуть False — передать дальше по цепочке или в default."""
+        """Вешает обработчик на текст. text — команда вроде "/start" или None на любое. filters — доп. проверка по update. state — только в этом FSM-состоянии. Вернуть False — передать дальше по цепочке или в default. max_concurrency — не больше стольких вызовов сразу, timeout — секунд на вызов; не уложился — вызов отменяется и выполняется on_timeout (текст ответа или функция (event)), без него — только запись в лог. executor — "thread" или "process": def-хендлер выполняется в пуле бота, а не в event loop (обычная def уходит в "thread" и без этого); строка или (text, keyboard), которые он вернул, уходят ответом."""
+
+        limits = HandlerLimits.from_options(max_concurrency, timeout, on_timeout)
 
         def decorator(func: Callable) -> Callable:
+            check_executor(func, executor)
             self._handlers.append({
                 "text": text,
                 "filter": filters,
                 "state": state,
                 "func": func,
+                "limits": limits,
+                "executor": executor,
+            })
+            return func
+
+        return decorator
+
+    def command_handler(
+        self,
+        pattern: str,
+        *,
+        aliases: Sequence[str] = (),
+        ignore_case: bool = False,
+        filters: Optional[Callable[[Dict], bool]] = None,
+        state: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+        on_timeout: OnTimeout = None,
+        executor: Optional[str] = None,
+    ) -> Callable:
+        """Обработчик команды с аргументами: "/order <int:id>", "/find <text:query>". Аргументы приходят в хендлер именованными: async def order(message, id). Типы — int, float, str (слово), text (остаток строки, только последним). aliases — другие имена команды, ignore_case — без учёта регистра. Стоит в общем порядке с message_handler; вернуть False — передать дальше. max_concurrency, timeout, on_timeout, executor — как у message_handler."""
+        command = CommandPattern(pattern, aliases=aliases, ignore_case=ignore_case)
+        limits = HandlerLimits.from_options(max_concurrency, timeout, on_timeout)
+
+        def decorator(func: Callable) -> Callable:
+            check_executor(func, executor)
+            self._handlers.append({
+                "text": None,
+                "command": command,
+                "filter": filters,
+                "state": state,
+                "func": func,
+                "limits": limits,
+                "executor": executor,
             })
             return func
 
@@ -97,14 +293,23 @@ class Bot:
         action: str,
         *,
         state: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+        on_timeout: OnTimeout = None,
+        executor: Optional[str] = None,
     ) -> Callable:
-        """Обработчик нажатия кнопки по cmd. action — как в кнопке, без слэша (cmd="/yes" → "yes"). state — опционально."""
+        """Обработчик нажатия кнопки по cmd. action — как в кнопке, без слэша (cmd="/yes" → "yes"). state — опционально. max_concurrency, timeout, on_timeout, executor — как у message_handler."""
+
+        limits = HandlerLimits.from_options(max_concurrency, timeout, on_timeout)
 
         def decorator(func: Callable) -> Callable:
+            check_executor(func, executor)
             self._button_handlers.append({
                 "action": action,
                 "state": state,
                 "func": func,
+                "limits": limits,
+                "executor": executor,
             })
             return func
 
@@ -115,13 +320,22 @@ class Bot:
         func: Optional[Callable] = None,
         *,
         filters: Optional[Callable[[Dict, Dict], bool]] = None,
+        max_concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+        on_timeout: OnTimeout = None,
+        executor: Optional[str] = None,
     ) -> Callable:
-        """Обработчик для кнопок без cmd или с произвольным payload (hash и т.д.). Вызывается, если button_handler по cmd не нашёлся. filters — (update, payload) -> bool."""
+        """Обработчик для кнопок без cmd или с произвольным payload (hash и т.д.). Вызывается, если button_handler по cmd не нашёлся. filters — (update, payload) -> bool. max_concurrency, timeout, on_timeout, executor — как у message_handler."""
+
+        limits = HandlerLimits.from_options(max_concurrency, timeout, on_timeout)
 
         def decorator(f: Callable) -> Callable:
+            check_executor(f, executor)
             self._callback_handlers.append({
                 "filter": filters if filters is not None else (lambda u, p: True),
                 "func": f,
+                "limits": limits,
+                "executor": executor,
             })
             return f
 
@@ -134,11 +348,13 @@ class Bot:
         func: Optional[Callable] = None,
         *,
         state: Optional[str] = None,
+        executor: Optional[str] = None,
     ) -> Callable:
-        """Вызывается для текста, когда ни один message_handler не подошёл. state — при желании ограничить по FSM."""
+        """Вызывается для текста, когда ни один message_handler не подошёл. state — при желании ограничить по FSM. executor — как у message_handler."""
 
         def decorator(f: Callable) -> Callable:
-            self._default_handlers.append({"state": state, "func": f})
+            check_executor(f, executor)
+            self._default_handlers.append({"state": state, "func": f, "executor": executor})
             return f
 
         if func is not None:
@@ -146,10 +362,11 @@ class Bot:
         return decorator
 
     def include_router(self, router: "Router") -> "Bot":
-        """Добавляет обработчики роутера в конец. Порядок: свои хендлеры, потом роутеры по порядку include_router. Срабатывает первый подходящий — порядок важен."""
+        """Подключает роутер (с вложенными) в текущее место: его хендлеры идут после хендлеров бота, зарегистрированных до вызова, и перед зарегистрированными позже. Срабатывает первый подходящий — порядок важен."""
         from .router import Router as RouterCls
         if isinstance(router, RouterCls):
-            router._merge_into(self)
+            self._routers.append(router)
+            self._router_marks.append(router_mark(self))
         return self
 
     def middleware(self, mw: Middleware) -> Middleware:
@@ -157,111 +374,182 @@ class Bot:
         self._middlewares.append(mw)
         return mw
 
+    def outer_middleware(self, mw: Middleware) -> Middleware:
+        """Middleware вокруг всего подбора хендлера — один раз на update, а не на каждую попытку хендлера. Сигнатура та же; data отсюда доходит до хендлера. Не вызвал handler — update дальше не идёт."""
+        self._outer_middlewares.append(mw)
+        return mw
+
     async def _run_middleware_chain(
         self,
         event: Any,
         data: Dict[str, Any],
         final_handler: Callable,
     ) -> Any:
-        """Гоняет event и data по цепочке middlewares, в конце — final_handler(event, data)."""
-        async def run(i: int, e: Any, d: Dict[str, Any]) -> Any:
-            if i >= len(self._middlewares):
-                return await final_handler(e, d)
-            async def next_h(e2: Any, d2: Dict[str, Any]) -> Any:
-                return await run(i + 1, e2, d2)
-            return await self._middlewares[i](next_h, e, d)
-        return await run(0, event, data)
-
-    def _keyboard_for_api(self, keyboard: Optional[List[List[Dict]]]) -> Optional[List[Dict]]:
+        """Гоняет event и data по цепочке middlewares, в конце — final_handler(event, data). Диспетчер пользуется готовыми цепочками из индекса."""
+        return await compile_chain(self._middlewares, final_handler)(event, data)
+
+    def _keyboard_for_api(self, keyboard: Optional[KeyboardLike]) -> Optional[List[Dict]]:
         """Клавиатура в формат API — плоский список кнопок."""
         if not keyboard:
             return None
-        flat = []
-        for row in keyboard:
-            for btn in row:
-                b = {"text": btn.get("text", "")}
-                cd = btn.get("callback_data") or btn.get("callbackData")
-                if cd is not None:
-                    b["callback_data"] = (
-                        cd if isinstance(cd, dict) else json.loads(cd) if isinstance(cd, str) else cd
-                    )
-                url = btn.get("url")
-                if isinstance(url, str) and url.strip():
-                    b["url"] = url.strip()
-                flat.append(b)
-        return flat
+        if isinstance(keyboard, FrozenKeyboard):
+            return keyboard.for_api()
+        return flatten_rows(keyboard, self._codec.loads)
 
-    async def _post_send_text(self, payload: Dict[str, Any], *, op: str) -> Optional[int]:
-        if not self._session:
+    def _keyboard_json(self, keyboard: Optional[KeyboardLike]) -> Optional[bytes]:
+        """Клавиатура сразу JSON'ом: у FrozenKeyboard — из кеша, обычная сериализуется. Пустая — None."""
+        if not keyboard:
             return None
+        if isinstance(keyboard, FrozenKeyboard):
+            return keyboard.encoded(self._codec)
+        return self._codec.dumps(flatten_rows(keyboard, self._codec.loads))
+
+    def _send_body(
+        self, login: str, text: str, keyboard: Optional[KeyboardLike], message_id: Optional[int] = None
+    ) -> Union[Dict[str, Any], bytes]:
+        """Тело sendText. С FrozenKeyboard — bytes: готовый JSON кнопок вклеивается без разбора и сериализации."""
+        payload: Dict[str, Any] = {"text": text, "login": login}
+        if message_id is not None:
+            payload["message_id"] = message_id
+        if isinstance(keyboard, FrozenKeyboard):
+            if not keyboard:
+                return payload
+            return self._codec.dumps(payload)[:-1] + b',"inline_keyboard":' + keyboard.encoded(self._codec) + b"}"
+        k = self._keyboard_for_api(keyboard)
+        if k is not None:
+            payload["inline_keyboard"] = k
+        return payload
+
+    async def _request_send_text(self, payload: Union[Dict[str, Any], bytes]) -> SendResult:
+        """Один POST sendText без повторов. payload — dict или готовое JSON-тело. Ошибку возвращает в SendResult, не бросает."""
+        if not self._session:
+            return SendResult(0, error="session closed")
+        body = payload if isinstance(payload, bytes) else self._codec.dumps(payload)
         try:
-            async with self._session.post(f"{BASE_URL}/messages/sendText", json=payload) as resp:
+            async with self._session.post(f"{BASE_URL}/messages/sendText", data=body) as resp:
+                raw = await resp.read()
                 if resp.status != 200:
-                    body = await resp.text()
-                    self._log.error("{} {}: {}", op, resp.status, body)
-                    return None
+                    return SendResult(
+                        resp.status,
+                        retry_after=_retry_after(resp.headers),
+                        error=raw.decode("utf-8", "replace"),
+                    )
+                data = self._codec.loads(raw) if raw else {}
 
-                try:
-                    data = await resp.json(content_type=None)
-                except Exception:
-                    body = await resp.text()
-                    data = json.loads(body) if body else {}
-
-                if isinstance(data, dict):
-                    message_id = data.get("message_id")
-                    return message_id if isinstance(message_id, int) else None
-                return None
+                message_id = data.get("message_id") if isinstance(data, dict) else None
+                return SendResult(200, message_id=message_id if isinstance(message_id, int) else None)
+        except aiohttp.ClientConnectorError as e:
+            return SendResult(0, error=str(e))
         except Exception as e:
-            self._log.exception("{}: {}", op, e)
+            # ответа нет, но запрос мог дойти — повторять вслепую нельзя
+            return SendResult(-1, error=repr(e))
+
+    async def _post_send_text(
+        self,
+        login: str,
+        payload: Union[Dict[str, Any], bytes],
+        *,
+        op: str,
+        wait: bool = True,
+        idempotent: bool = False,
+    ) -> Optional[int]:
+        """Отправка через исходящую очередь. wait=False — поставить в очередь и сразу вернуть None. idempotent — можно повторить, даже если ответа не было."""
+        if self._outbox is None:
+            return None
+        fut = self._outbox.enqueue(login, payload, op, idempotent=idempotent)
+        if not wait:
             return None
+        return (await fut).message_id
 
     async def send_message(
         self,
         login: str,
         text: str,
-        keyboard: Optional[List[List[Dict]]] = None,
+        keyboard: Optional[KeyboardLike] = None,
+        *,
+        wait: bool = True,
     ) -> Optional[int]:
-        """Шлёт текст пользователю по login. keyboard — результат Keyboard().build(), можно не передавать. Возвращает message_id или None."""
-        payload: Dict[str, Any] = {"text": text, "login": login}
-        if keyboard is not None:
-            k = self._keyboard_for_api(keyboard)
-            if k is not None:
-                payload["inline_keyboard"] = k
-        return await self._post_send_text(payload, op="send_message")
+        """Шлёт текст пользователю по login. keyboard — результат Keyboard().build() или Keyboard().freeze(), можно не передавать. Возвращает message_id или None. wait=False — только поставить в очередь отправки и не ждать ответа API (вернёт None)."""
+        payload = self._send_body(login, text, keyboard)
+        return await self._post_send_text(login, payload, op="send_message", wait=wait)
 
     async def edit_message_text(
         self,
         login: str,
         message_id: int,
         text: str,
-        keyboard: Optional[List[List[Dict]]] = None,
+        keyboard: Optional[KeyboardLike] = None,
+        *,
+        wait: bool = True,
     ) -> Optional[int]:
-        """Редактирует сообщение по login. keyboard — результат Keyboard().build(), можно не передавать. Возвращает message_id или None."""
-        payload: Dict[str, Any] = {"text": text, "login": login, "message_id": message_id}
-        if keyboard is not None:
-            k = self._keyboard_for_api(keyboard)
-            if k is not None:
-                payload["inline_keyboard"] = k
-        return await self._post_send_text(payload, op="edit_message_text")
+        """Редактирует сообщение по login. keyboard — как у send_message, можно не передавать. Возвращает message_id или None. wait — как у send_message. С edit_debounce правка может быть склеена с последующими — тогда вернётся итог той, что ушла."""
+        if self._edits is not None:
+            fut = self._edits.submit(login, message_id, text, keyboard)
+            return await fut if wait else None
+        return await self._edit_now(login, message_id, text, keyboard, wait=wait)
+
+    async def _edit_now(
+        self, login: str, message_id: int, text: str, keyboard: Optional[KeyboardLike], *, wait: bool = True
+    ) -> Optional[int]:
+        """Правка без склейки: тело собирается здесь, поэтому у склеенных правок сериализуется только последняя."""
+        payload = self._send_body(login, text, keyboard, message_id)
+        # повтор правки с тем же текстом безвреден — можно повторять даже без ответа сервера
+        return await self._post_send_text(login, payload, op="edit_message_text", wait=wait, idempotent=True)
 
     async def reply(
         self,
         text: str,
-        keyboard: Optional[List[List[Dict]]] = None,
+        keyboard: Optional[KeyboardLike] = None,
+        *,
+        wait: bool = True,
     ) -> Optional[int]:
-        """Шлёт сообщение тому, кто написал/нажал. Только из хендлера — из create_task контекста нет, вернёт None и warning."""
+        """Шлёт сообщение тому, кто написал/нажал. Только из хендлера — из create_task контекста нет, вернёт None и warning. wait — как у send_message."""
         login = _current_login.get()
         if not login:
             self._log.warning("reply() вызван вне контекста обновления")
             return None
-        return await self.send_message(login, text, keyboard)
+        return await self.send_message(login, text, keyboard, wait=wait)
+
+    def broadcast(
+        self,
+        logins: Union[Iterable[str], AsyncIterable[str]],
+        text: str,
+        keyboard: Optional[KeyboardLike] = None,
+        *,
+        concurrency: int = 32,
+        on_progress: Optional[Callable[[int, int], Any]] = None,
+        progress_every: int = 100,
+    ) -> AsyncIterator[BroadcastResult]:
+        """Рассылка одного текста многим: async for r in bot.broadcast(logins, text): ... — по BroadcastResult (login, message_id, error) на получателя, в порядке завершения. logins — iterable или async iterable, читается по мере отправки. concurrency — сколько отправок в очереди одновременно (остальным пользователям очередь не забивается). on_progress(sent, failed) — каждые progress_every получателей и в конце. Лимиты и Retry-After — как у обычной отправки."""
+        return broadcast(
+            self,
+            logins,
+            text,
+            keyboard,
+            concurrency=concurrency,
+            on_progress=on_progress,
+            progress_every=progress_every,
+        )
 
     def current_login(self) -> Optional[str]:
         """Логин того, чьё обновление сейчас в работе. Удобно для bot.state(bot.current_login()). Вне хендлера — None."""
         return _current_login.get()
 
-    def _parse_update(self, update: Dict) -> Optional[tuple]:
-        """Достаёт из update login, text и payload (если кнопка). Единая точка входа под API — меняешь только тут."""
+    def run_from_thread(self, coro: Awaitable[Any]) -> Any:
+        """Из def-хендлера в потоке: выполняет корутину бота в его event loop и ждёт результат — bot.run_from_thread(bot.reply("Готово")). Login и бот — того же update."""
+        loop = self._executors.loop
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if loop is None or running is loop:
+            if inspect.iscoroutine(coro):
+                coro.close()
+            raise RuntimeError("run_from_thread is for handlers running in a thread; in async code use await")
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    def _parse_update(self, update: Dict) -> Optional[ParsedUpdate]:
+        """Разбирает update один раз: login, text и payload (если кнопка) в ParsedUpdate — его делят фильтры, диспетчер и Message/CallbackQuery. Единая точка входа под API — меняешь только тут."""
         try:
             user = update.get("from") if isinstance(update.get("from"), dict) else {}
             login = user.get("login") if user else None
@@ -270,202 +558,514 @@ class Bot:
             text = (update.get("text") or "").strip() if isinstance(update.get("text"), (str, type(None))) else ""
             raw = update.get("callbackData") or update.get("callback_data") or update.get("payload")
             if raw is None:
-                return (login, text, None)
+                return ParsedUpdate(self, update, login, text)
             if isinstance(raw, dict):
-                return (login, text, raw)
+                return ParsedUpdate(self, update, login, text, raw)
             if isinstance(raw, str):
                 try:
-                    return (login, text, json.loads(raw))
-                except (json.JSONDecodeError, TypeError):
+                    return ParsedUpdate(self, update, login, text, self._codec.loads(raw))
+                except (ValueError, TypeError):
                     return None
             return None
         except (AttributeError, TypeError, KeyError) as e:
             self._log.warning("parse_update: invalid structure: {}", e)
             return None
 
-    async def _get_updates(self) -> List[Dict]:
-        """Забирает новые обновления. При ошибке сети — [], в лог warning, цикл не падает."""
-        if not self._session:
-            return []
-        url = f"{BASE_URL}/messages/getUpdates?offset={self._last_update_id + 1}&limit=10"
+    async def _get_updates(self) -> Optional[List[Dict]]:
+        """Забирает новые обновления. Сбой API или сети — None (в лог warning, цикл не падает), breaker open — None без запроса."""
+        session = self._poll_session or self._session
+        if not session:
+            return None
+        if self._journal is not None:
+            # новый offset подтверждает серверу прошлую пачку — она должна быть уже на диске
+            await self._journal.commit()
+        if not self._poll_breaker.allow():
+            return None
+        url = f"{BASE_URL}/messages/getUpdates?offset={self._last_update_id + 1}&limit={self._poll_limit}"
+        status: Optional[int] = -1
         try:
             timeout = aiohttp.ClientTimeout(total=60)
-            async with self._session.get(url, timeout=timeout) as resp:
+            async with session.get(url, timeout=timeout) as resp:
+                status = resp.status
                 if resp.status != 200:
-                    return []
-                data = await resp.json()
+                    self._log.warning("get_updates {} — повтор через паузу", resp.status)
+                    return None
+                data = self._codec.loads(await resp.read())
                 updates = data.get("updates", [])
                 if updates:
-                    self._last_update_id = updates[-1]["update_id"]
+                    # в журнал — сразу и до offset: следующий getUpdates (в конвейере он уходит до раздачи) подтвердит
+                    # эту пачку, а сбой записи оставит offset на месте — пачка придёт снова, а не потеряется
+                    self._journal_received(updates)
+                    # max, а не последний: повторно доставленный старый update не должен откатить offset
+                    self._last_update_id = max(self._last_update_id, max(u["update_id"] for u in updates))
                 return updates
+        except asyncio.CancelledError:
+            # опрос остановили — это не итог вызова API
+            status = None
+            raise
+        except aiohttp.ClientConnectorError as e:
+            status = 0
+            self._log.warning("get_updates (сеть): {} — повтор через паузу", e)
+            return None
         except (aiohttp.ClientError, OSError, ConnectionError, asyncio.TimeoutError) as e:
+            status = -1
             self._log.warning("get_updates (сеть): {} — повтор через паузу", e)
-            return []
+            return None
         except Exception as e:
+            status = -1
             self._log.warning("get_updates: {} — повтор через паузу", e)
-            return []
+            return None
+        finally:
+            if status is None:
+                self._poll_breaker.release()
+            else:
+                self._poll_breaker.record(status)
+
+    def _failure_pause(self, failures: int) -> float:
+        """Пауза опроса после failures сбоев подряд: экспонента с jitter, но не раньше пробного вызова breaker."""
+        return max(self._retry_policy.delay(failures - 1), self._poll_breaker.retry_in())
+
+    @property
+    def breaker(self) -> CircuitBreaker:
+        """Circuit breaker отправок (sendText, edit, рассылки): state — "closed" / "open" / "half_open"."""
+        return self._breaker
+
+    @property
+    def poll_breaker(self) -> CircuitBreaker:
+        """Circuit breaker опроса getUpdates — отдельный от отправок."""
+        return self._poll_breaker
+
+    @property
+    def api_available(self) -> bool:
+        """False, пока breaker разомкнут: отправки сразу отклоняются — хендлер может ответить иначе или отложить работу."""
+        return self._breaker.available
+
+    def _handler_index(self) -> HandlerIndex:
+        """Индекс хендлеров; пересобирается, если после прошлой сборки добавились хендлеры, роутеры или middleware."""
+        index = self._index
+        if index is None or index.signature != HandlerIndex.signature_of(self):
+            index = self._index = HandlerIndex(
+                self, dispatch_message=self._dispatch_message, dispatch_callback=self._dispatch_callback
+            )
+        return index
 
     async def _process_update(self, update: Dict) -> None:
-        """Один update: кнопка → _handle_callback, иначе — подбор message/default handler."""
+        """Один update: outer-middlewares, затем кнопка → _dispatch_callback, иначе — подбор message/default handler."""
         parsed = self._parse_update(update)
-        if not parsed:
-            return
-        login, text, payload = parsed
-
-        if payload is not None:
-            await self._handle_callback(update, login, payload)
+        if parsed is None:
             return
 
+        storage = self._storage
+        login = parsed.login
+        # пока update в работе, вытеснение LRU/TTL обходит этого пользователя: хендлер держит его dict и state
+        storage.pin(login)
         token_login = _current_login.set(login)
         token_bot = _current_bot.set(self)
         try:
-            current_state = get_state(self, login)
-            handled = False
-            event = Message(update)
-            data: Dict[str, Any] = {}
-            for h in self._handlers:
-                if h["state"] is not None and h["state"] != current_state:
-                    continue
-                if h["text"] is not None and h["text"] != text:
-                    continue
-                if h.get("filter") is not None and not h["filter"](update):
-                    continue
-                try:
-                    if self._middlewares:
-                        async def _final(e: Any, d: Dict[str, Any], func: Callable = h["func"]) -> Any:
-                            return await func(e, **d)
-                        result = await self._run_middleware_chain(event, dict(data), _final)
-                    else:
-                        result = await h["func"](event)
-                    if result is not False:
-                        handled = True
-                        break
-                except Exception as e:
-                    self._log.exception("handler: {}", e)
-            if not handled:
-                for h in self._default_handlers:
-                    if h["state"] is not None and h["state"] != current_state:
-                        continue
-                    try:
-                        if self._middlewares:
-                            async def _final_def(e: Any, d: Dict[str, Any], func: Callable = h["func"]) -> Any:
-                                return await func(e, **d)
-                            await self._run_middleware_chain(event, dict(data), _final_def)
-                        else:
-                            await h["func"](event)
-                        handled = True
-                        break
-                    except Exception as e:
-                        self._log.exception("default_handler: {}", e)
-                if not handled:
-                    await self.reply("Не понимаю. Введите /start или /menu.")
+            if login and storage.needs_prefetch(login):
+                # постоянное хранилище: пользователь подгружается до хендлеров, дальше get_state/state — из памяти
+                await storage.prefetch(login)
+            index = self._handler_index()
+            if parsed.payload is not None:
+                await index.outer_callback(CallbackQuery(update, parsed.payload, parsed), {})
+            else:
+                await index.outer_message(Message(update, parsed), {})
         finally:
             _current_login.reset(token_login)
             _current_bot.reset(token_bot)
+            storage.unpin(login)
 
-    async def _handle_callback(self, update: Dict, login: str, payload: Dict) -> None:
+    async def _dispatch_message(self, event: Message, data: Dict[str, Any]) -> None:
+        """Текст: первый подходящий message_handler (вернул не False), иначе default_handler."""
+        index = self._index
+        # один разобранный update на все фильтры кандидатов
+        ctx = event.parsed
+        current_state = ctx.state
+        verdicts: Dict[int, bool] = {}
+        for h in index.messages(event.text, current_state):
+            if h.guards and not index.admits(h, ctx, verdicts):
+                continue
+            args = None
+            if h.command is not None:
+                args = h.command.parse(event.text)
+                if args is None:
+                    continue
+            if h.check is not None and not h.check(ctx):
+                continue
+            # своя копия data на попытку: middleware неудачной попытки не влияет на следующую
+            call_data = dict(data) if data else {}
+            if args:
+                call_data.update(args)
+            try:
+                result = await h.call(event, call_data)
+                if result is not False:
+                    return
+            except HandlerTimeout as e:
+                await self._handler_timed_out(e, event)
+                return
+            except Exception as e:
+                self._log.exception("handler: {}", e)
+        for h in index.defaults(current_state):
+            if h.guards and not index.admits(h, ctx, verdicts):
+                continue
+            try:
+                await h.call(event, dict(data) if data else {})
+                return
+            except Exception as e:
+                self._log.exception("default_handler: {}", e)
+        await self.reply("Не понимаю. Введите /start или /menu.")
+
+    async def _dispatch_callback(self, event: CallbackQuery, data: Dict[str, Any]) -> None:
         """Кнопка: сначала button_handler по cmd, если нет — callback_handler по фильтру."""
-        token_login = _current_login.set(login)
-        token_bot = _current_bot.set(self)
-        try:
-            current_state = get_state(self, login)
-            cmd = payload.get("cmd") or payload.get("action")
-            cb_event = CallbackQuery(update, payload)
-            cb_data: Dict[str, Any] = {}
-            if cmd:
-                action = (cmd.lstrip("/") if isinstance(cmd, str) else str(cmd))
-                for h in self._button_handlers:
-                    if h["action"] != action:
-                        continue
-                    if h["state"] is not None and h["state"] != current_state:
-                        continue
-                    try:
-                        if self._middlewares:
-                            async def _final_btn(e: Any, d: Dict[str, Any], func: Callable = h["func"]) -> Any:
-                                return await func(e, **d)
-                            await self._run_middleware_chain(cb_event, dict(cb_data), _final_btn)
-                        else:
-                            await h["func"](cb_event)
-                        return
-                    except Exception as e:
-                        self._log.exception("button handler: {}", e)
-                        await self.reply("Ошибка при обработке действия.")
-                        return
-            for h in self._callback_handlers:
-                if not h["filter"](update, payload):
+        index = self._index
+        payload = event.payload
+        ctx = event.parsed
+        verdicts: Dict[int, bool] = {}
+        cmd = payload.get("cmd") or payload.get("action")
+        if cmd:
+            action = (cmd.lstrip("/") if isinstance(cmd, str) else str(cmd))
+            for h in index.buttons(action, ctx.state):
+                if h.guards and not index.admits(h, ctx, verdicts):
                     continue
                 try:
-                    if self._middlewares:
-                        async def _final_cb(e: Any, d: Dict[str, Any], func: Callable = h["func"]) -> Any:
-                            return await func(e, **d)
-                        await self._run_middleware_chain(cb_event, dict(cb_data), _final_cb)
-                    else:
-                        await h["func"](cb_event)
-                    return
+                    await h.call(event, dict(data) if data else {})
+                except HandlerTimeout as e:
+                    await self._handler_timed_out(e, event)
                 except Exception as e:
-                    self._log.exception("callback_handler: {}", e)
-            await self.reply("Неизвестное действие.")
-        finally:
-            _current_login.reset(token_login)
-            _current_bot.reset(token_bot)
+                    self._log.exception("button handler: {}", e)
+                    await self.reply("Ошибка при обработке действия.")
+                return
+        for h in index.callbacks(payload):
+            if h.guards and not index.admits(h, ctx, verdicts):
+                continue
+            if h.check is not None and not h.check(ctx):
+                continue
+            try:
+                await h.call(event, dict(data) if data else {})
+                return
+            except HandlerTimeout as e:
+                await self._handler_timed_out(e, event)
+                return
+            except Exception as e:
+                self._log.exception("callback_handler: {}", e)
+        await self.reply("Неизвестное действие.")
 
-    def _task_done_callback(self, task: asyncio.Task) -> None:
-        """Снимает задачу с учёта, при исключении — логирует."""
-        self._pending_tasks.discard(task)
+    async def _handler_timed_out(self, exc: HandlerTimeout, event: Union[Message, CallbackQuery]) -> None:
+        """Хендлер отменён по timeout: запись в лог и on_timeout. Дальше по цепочке update не идёт — хендлер уже начал работу."""
+        self._log.warning("handler: {}", exc)
+        action = exc.limits.on_timeout
+        if action is None:
+            return
         try:
-            exc = task.exception()
-            if exc is not None:
-                self._log.exception("update task: {}", exc)
-        except asyncio.CancelledError:
-            pass
+            if isinstance(action, str):
+                await self.reply(action)
+                return
+            result = action(event)
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            self._log.exception("on_timeout: {}", e)
 
-    async def run(self) -> None:
-        """Long polling до остановки. Каждое обновление — отдельная задача (до 128 параллельно). Остановка — Ctrl+C или stop(); перед выходом ждёт активные задачи до 10 с."""
-        self._session = aiohttp.ClientSession(
-            headers={
-                "Authorization": f"OAuth {self.api_key}",
-                "Content-Type": "application/json",
-            }
+    def _start_dispatcher(self) -> None:
+        if self._process_factory is not None:
+            from .multiproc import start_process_dispatcher
+            self._dispatcher = start_process_dispatcher(self, *self._process_factory)
+            return
+        self._dispatcher = ShardedDispatcher(
+            self._process_update,
+            self._workers,
+            self._log,
+            max_pending=self._intake_size,
+            shed_after=self._shed_after,
+            on_shed=self._shed_update,
+            on_done=self._update_done if self._journal is not None else None,
         )
-        self._running = True
-        semaphore = asyncio.Semaphore(128)
-        self._log.info("Bot started")
+        self._dispatcher.start()
+
+    def _update_done(self, update: Dict) -> None:
+        self._journal.done(update.get("update_id"))
+
+    def _mark_seen(self, update: Dict) -> bool:
+        """Запоминает update_id. False — такой update уже был (повторная доставка), обрабатывать не нужно."""
+        if self._seen is None:
+            return True
+        uid = update.get("update_id")
+        if uid is None:
+            return True
+        if self._seen.add(uid):
+            return True
+        self._log.debug("duplicate update {} пропущен", uid)
+        return False
+
+    def _is_seen(self, update: Dict) -> bool:
+        return self._seen is not None and update.get("update_id") in self._seen
+
+    async def _start_intake(self) -> None:
+        """Индекс хендлеров, хранилище, шарды, список виденных update_id и журнал — общий старт для run() и run_webhook()."""
+        self._handler_index()
+        if self._process_factory is None:
+            # в run_multiprocess хендлеры и хранилище — в процессах-воркерах
+            await self._storage.open()
+        self._start_dispatcher()
+        if self._seen is not None and self._dedup_path:
+            self._seen.load(self._dedup_path)
+            self._dedup_saver = asyncio.create_task(self._dedup_save_loop())
+        await self._open_journal()
+
+    async def _stop_intake(self) -> None:
+        await self._stop_dispatcher()
+        self._executors.shutdown()
+        if self._process_factory is None:
+            try:
+                await self._storage.close()
+            except Exception as e:
+                self._log.exception("storage close: {}", e)
+        await self._close_journal()
+        if self._dedup_saver is not None:
+            self._dedup_saver.cancel()
+            await asyncio.gather(self._dedup_saver, return_exceptions=True)
+            self._dedup_saver = None
+        if self._seen is not None and self._dedup_path:
+            try:
+                self._seen.save(self._dedup_path)
+            except OSError as e:
+                self._log.warning("dedup: не удалось сохранить {}: {}", self._dedup_path, e)
+
+    async def _dedup_save_loop(self) -> None:
+        """Раз в dedup_save_interval сохраняет список виденных update_id, если в нём есть новые, — чтобы он пережил и падение. Снимок берётся в loop, файл пишется в потоке."""
+        loop = asyncio.get_running_loop()
+        saved = None
+        while True:
+            await asyncio.sleep(self._dedup_save_interval)
+            ids = self._seen.ids()
+            newest = ids[-1] if ids else None
+            if newest == saved:
+                continue
+            try:
+                await loop.run_in_executor(None, SeenUpdates.write, self._dedup_path, ids)
+                saved = newest
+            except OSError as e:
+                self._log.warning("dedup: не удалось сохранить {}: {}", self._dedup_path, e)
+
+    async def _open_journal(self) -> None:
+        """Поднимает журнал: offset — не меньше сохранённого, незавершённые updates — снова в шарды (в журнал второй раз не пишутся)."""
+        if self._journal is None:
+            return
+        pending, offset = self._journal.open()
+        self._last_update_id = max(self._last_update_id, offset)
+        self._journal.start()
+        if pending:
+            self._log.info("journal: повтор {} незавершённых updates", len(pending))
+        for u in pending:
+            if self._seen is not None and u.get("update_id") is not None:
+                self._seen.add(u["update_id"])
+            await self._dispatcher.put(u)
+
+    async def _close_journal(self) -> None:
+        if self._journal is not None:
+            await self._journal.close()
+
+    async def _shed_update(self, update: Dict) -> None:
+        """update пролежал в очереди дольше shed_after: "drop" — только лог, "busy" — короткий ответ без хендлеров и middleware."""
+        login = update_login(update)
+        self._log.warning("shed update {} от {}", update.get("update_id"), login)
+        if self._shed_policy == "busy" and login:
+            # только в очередь отправки: шард под перегрузкой не ждёт ответа API и лимитов скорости
+            await self.send_message(login, self._busy_text, wait=False)
+
+    async def _stop_dispatcher(self) -> None:
+        """Дожидается очередей шардов до 10 с и гасит воркеров."""
+        if self._dispatcher is not None:
+            await self._dispatcher.stop(timeout=10.0)
+            self._dispatcher = None
+
+    def _journal_received(self, updates: List[Dict]) -> None:
+        """Пачка получена — в буфер журнала, кроме уже виденных. На диске она будет до того, как новый offset подтвердит её серверу."""
+        journal = self._journal
+        if journal is None:
+            return
+        for u in updates:
+            if not self._is_seen(u):
+                journal.record(u)
+
+    async def _hand_off(self, updates: List[Dict]) -> None:
+        """Раздаёт пачку updates по шардам (login → воркер). Повторно доставленные пропускает. Приём заполнен — ждёт, и опрос вместе с ним. В журнал пачку уже записал _get_updates."""
+        dispatcher = self._dispatcher
+        for u in updates:
+            if not self._mark_seen(u):
+                continue
+            await dispatcher.put(u)
+
+    async def _poll_sleeping(self) -> None:
+        """Классический цикл: getUpdates → раздать → пауза poll_active_sleep/poll_idle_sleep. Сбои — пауза по retry-политике и breaker."""
+        failures = 0
+        while self._running:
+            try:
+                updates = await self._get_updates()
+                if updates is None:
+                    failures += 1
+                    await asyncio.sleep(self._failure_pause(failures))
+                    continue
+                failures = 0
+                await self._hand_off(updates)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                failures += 1
+                self._log.exception("process_updates: {}", e)
+                await asyncio.sleep(self._failure_pause(failures))
+            else:
+                # были обновления — мало ждём, быстрее подхватим следующие; пусто — дольше, чтобы не долбить API
+                await asyncio.sleep(self._poll_active_sleep if updates else self._poll_idle_sleep)
+
+    async def _poll_pipelined(self) -> None:
+        """Конвейер: пока раздаём пачку, следующий getUpdates уже в полёте. Пустые ответы — backoff от 50 мс до poll_idle_sleep, сбои — по retry-политике и breaker."""
+        fetch: Optional[asyncio.Task] = None
+        idle = 0.0
+        failures = 0
         try:
+            fetch = asyncio.create_task(self._get_updates())
             while self._running:
                 try:
-                    updates = await self._get_updates()
-                    for u in updates:
-                        async def process_one(update: Dict) -> None:
-                            async with semaphore:
-                                await self._process_update(update)
-                        task = asyncio.create_task(process_one(u))
-                        self._pending_tasks.add(task)
-                        task.add_done_callback(self._task_done_callback)
+                    updates = await fetch
+                    fetch = None
+                    if updates is None:
+                        failures += 1
+                        await asyncio.sleep(self._failure_pause(failures))
+                    elif updates:
+                        failures = 0
+                        # offset уже сдвинут в _get_updates — можно сразу просить следующую пачку
+                        fetch = asyncio.create_task(self._get_updates())
+                        await self._hand_off(updates)
+                        idle = 0.0
+                        continue
+                    else:
+                        failures = 0
+                        idle = min(max(idle * 2, _POLL_BACKOFF_START), self._poll_idle_sleep)
+                        await asyncio.sleep(idle)
                 except asyncio.CancelledError:
                     break
-                except (OSError, ConnectionError, asyncio.TimeoutError) as e:
-                    self._log.warning("Сеть: {} — пауза 15 с", e)
-                    await asyncio.sleep(15)
                 except Exception as e:
+                    failures += 1
                     self._log.exception("process_updates: {}", e)
-                    await asyncio.sleep(5)
-                else:
-                    # были обновления — мало ждём, быстрее подхватим следующие; пусто — дольше, чтобы не долбить API
-                    await asyncio.sleep(self._poll_active_sleep if updates else self._poll_idle_sleep)
+                    await asyncio.sleep(self._failure_pause(failures))
+                if self._running and fetch is None:
+                    fetch = asyncio.create_task(self._get_updates())
         finally:
-            if self._pending_tasks:
-                done, pending = await asyncio.wait(
-                    self._pending_tasks, timeout=10.0, return_when=asyncio.ALL_COMPLETED
-                )
-                for t in pending:
-                    t.cancel()
-                if pending:
-                    await asyncio.gather(*pending, return_exceptions=True)
+            if fetch is not None and not fetch.done():
+                fetch.cancel()
+                await asyncio.gather(fetch, return_exceptions=True)
+
+    def _new_session(self, limit: int, limit_per_host: int) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=limit,
+            limit_per_host=limit_per_host,
+            keepalive_timeout=self._http_keepalive,
+            use_dns_cache=self._http_dns_ttl is not None,
+            ttl_dns_cache=self._http_dns_ttl,
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            auto_decompress=True,
+            headers={
+                "Authorization": f"OAuth {self.api_key}",
+                "Content-Type": "application/json",
+                "Accept-Encoding": "gzip, deflate" if self._http_compress else "identity",
+            },
+        )
+
+    def _open_session(self, *, polling: bool = False) -> None:
+        """Сессии к API. Отправка — свой пул на http_pool_size соединений; polling=True — ещё отдельный пул для getUpdates, чтобы долгий опрос не занимал соединения отправки."""
+        self._session = self._new_session(self._http_pool_size, self._http_pool_per_host)
+        if polling:
+            self._poll_session = self._new_session(1, 1)
+        self._outbox = Outbox(self._request_send_text, self._log, **self._outbox_options)
+        self._outbox.start()
+        if self._edit_debounce is not None:
+            self._edits = EditCoalescer(
+                self._edit_now, self._log, debounce=self._edit_debounce, max_latency=self._edit_max_latency
+            )
+
+    async def _close_session(self) -> None:
+        """Отправляет склеиваемые правки, дожидается исходящей очереди (до 10 с) и закрывает сессии."""
+        if self._edits is not None:
+            await self._edits.flush()
+            self._edits = None
+        if self._outbox is not None:
+            await self._outbox.stop(timeout=10.0)
+            self._outbox = None
+        if self._poll_session is not None:
+            await self._poll_session.close()
+            self._poll_session = None
+        if self._session is not None:
             await self._session.close()
             self._session = None
+
+    async def run(self) -> None:
+        """Long polling до остановки. Updates раздаются по workers шардам: один login — по порядку, разные — параллельно. Остановка — Ctrl+C или stop(); перед выходом ждёт очереди до 10 с."""
+        self._open_session(polling=True)
+        self._running = True
+        self._log.info("Bot started")
+        try:
+            await self._start_intake()
+            if self._poll_pipeline:
+                await self._poll_pipelined()
+            else:
+                await self._poll_sleeping()
+        finally:
+            await self._stop_intake()
+            await self._close_session()
+            self._running = False
+            self._log.info("Bot stopped")
+
+    async def run_multiprocess(self, factory: Callable[[], "Bot"], *, processes: int = 2) -> None:
+        """Как run(), но хендлеры работают в processes отдельных процессах. Этот бот только опрашивает API (журнал, dedup, intake_size — его); каждый процесс строит свой Bot через factory — функцию уровня модуля без аргументов, которая регистрирует те же роутеры. Пользователь закреплён за процессом по login, ответы уходят прямо из процессов."""
+        if processes < 1:
+            raise ValueError("processes must be >= 1")
+        self._process_factory = (factory, processes)
+        try:
+            await self.run()
+        finally:
+            self._process_factory = None
+
+    def webhook_app(
+        self,
+        path: str = "/webhook",
+        *,
+        max_body_size: int = 1024 * 1024,
+    ) -> "web.Application":
+        """aiohttp-приложение для приёма updates пушем — можно поднять своим runner'ом или в aiohttp test client. Приём заполнен (intake_size) — 503. max_body_size — предел тела запроса (больше — 413)."""
+        from .webhook import build_app
+        return build_app(self, path, max_body_size=max_body_size)
+
+    async def run_webhook(
+        self,
+        host: str = "0.0.0.0",
+        port: int = 8080,
+        path: str = "/webhook",
+        *,
+        max_body_size: int = 1024 * 1024,
+    ) -> None:
+        """Webhook вместо long polling: HTTP-сервер на host:port принимает POST на path ({"updates": [...]}, список или один update) и гонит их через ту же обработку, что и run(). Остановка — Ctrl+C или stop()."""
+        from aiohttp import web
+        app = self.webhook_app(path, max_body_size=max_body_size)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        self._running = True
+        self._stop_event = asyncio.Event()
+        try:
+            site = web.TCPSite(runner, host, port)
+            await site.start()
+            self._log.info("Bot webhook started on {}:{}{}", host, port, path)
+            await self._stop_event.wait()
+        finally:
+            await runner.cleanup()
+            self._stop_event = None
             self._running = False
             self._log.info("Bot stopped")
 
     def stop(self) -> None:
-        """Останавливает цикл — run() выйдет на следующей итерации."""
+        """Останавливает цикл — run() выйдет на следующей итерации, run_webhook() — сразу."""
         self._running = False
+        if self._stop_event is not None:
+            self._stop_event.set()
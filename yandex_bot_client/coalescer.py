@@ -0,0 +1,90 @@
+"""Склейка частых правок одного сообщения: из серии edit_message_text по (login, message_id) уходит только последняя. Быстрые нажатия в мультивыборе дают одну правку, а не гонку из пяти."""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+_Key = Tuple[str, int]
+_Send = Callable[[str, int, str, Any], Awaitable[Optional[int]]]
+
+
+class _Pending:
+    """Последнее содержимое сообщения, ждущее отправки, и все, кто ждёт её итога."""
+
+    __slots__ = ("text", "keyboard", "waiters", "deadline", "timer")
+
+    def __init__(self, text: str, keyboard: Any, deadline: float) -> None:
+        self.text = text
+        self.keyboard = keyboard
+        self.waiters: List["asyncio.Future[Optional[int]]"] = []
+        self.deadline = deadline
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class EditCoalescer:
+    """Правка ждёт debounce секунд тишины; новая правка того же сообщения заменяет текст и клавиатуру и сдвигает срок, но не дальше max_latency от первой. Ушедшая правка не отменяется — следующая встанет за ней в очередь отправки login, поэтому последним всегда доставляется последнее состояние."""
+
+    def __init__(self, send: _Send, log: Any, *, debounce: float = 0.3, max_latency: float = 1.0) -> None:
+        if debounce <= 0:
+            raise ValueError("debounce must be > 0")
+        if max_latency < debounce:
+            raise ValueError("max_latency must be >= debounce")
+        self._send = send
+        self._log = log
+        self._debounce = debounce
+        self._max_latency = max_latency
+        self._pending: Dict[_Key, _Pending] = {}
+        self._flushing: Set[asyncio.Task] = set()
+
+    @property
+    def pending(self) -> int:
+        """Сколько сообщений ждут правки."""
+        return len(self._pending)
+
+    def submit(
+        self, login: str, message_id: int, text: str, keyboard: Any = None
+    ) -> "asyncio.Future[Optional[int]]":
+        """Ставит правку. Future — message_id той отправки, что доставила это или более новое содержимое (None при ошибке)."""
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        key = (login, message_id)
+        entry = self._pending.get(key)
+        if entry is None:
+            entry = _Pending(text, keyboard, now + self._max_latency)
+            self._pending[key] = entry
+        else:
+            entry.text = text
+            entry.keyboard = keyboard
+            entry.timer.cancel()
+        fut: "asyncio.Future[Optional[int]]" = loop.create_future()
+        entry.waiters.append(fut)
+        delay = max(min(now + self._debounce, entry.deadline) - now, 0.0)
+        entry.timer = loop.call_later(delay, self._fire, key)
+        return fut
+
+    def _fire(self, key: _Key) -> None:
+        entry = self._pending.pop(key, None)
+        if entry is None:
+            return
+        task = asyncio.ensure_future(self._deliver(key, entry))
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    async def _deliver(self, key: _Key, entry: _Pending) -> None:
+        login, message_id = key
+        try:
+            result = await self._send(login, message_id, entry.text, entry.keyboard)
+        except Exception as e:
+            self._log.exception("edit_message_text: {}", e)
+            result = None
+        for fut in entry.waiters:
+            if not fut.done():
+                fut.set_result(result)
+
+    async def flush(self) -> None:
+        """Отправляет все ждущие правки сразу и дожидается их. Вызывается при остановке — последнее состояние не теряется."""
+        for key, entry in list(self._pending.items()):
+            entry.timer.cancel()
+            self._fire(key)
+        if self._flushing:
+            await asyncio.gather(*self._flushing, return_exceptions=True)
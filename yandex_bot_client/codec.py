@@ -0,0 +1,77 @@
+"""JSON-кодек бота: одна настройка для тел запросов, ответов API, payload кнопок, webhook и журнала. orjson — если установлен, иначе stdlib json. Кодирует сразу в bytes, декодирует из bytes без промежуточной str."""
+
+import json
+from abc import ABC, abstractmethod
+from typing import Any, Union
+
+
+class JsonCodec(ABC):
+    """Контракт кодека: dumps(obj) → bytes (UTF-8, без пробелов), loads(bytes | str) → объект. Ошибка разбора — ValueError."""
+
+    name = "abstract"
+
+    @abstractmethod
+    def dumps(self, obj: Any) -> bytes:
+        """obj → JSON в bytes."""
+
+    @abstractmethod
+    def loads(self, data: Union[bytes, str]) -> Any:
+        """JSON → объект; ошибка разбора — ValueError."""
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}()"
+
+
+class StdlibCodec(JsonCodec):
+    """Стандартный json. Кириллица — как есть, не \\uXXXX: тело короче."""
+
+    name = "json"
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        # json.loads сам определяет кодировку bytes — без decode() на нашей стороне
+        return json.loads(data)
+
+
+class OrjsonCodec(JsonCodec):
+    """orjson: в разы быстрее stdlib и на dumps, и на loads. Его JSONDecodeError — подкласс ValueError. Принимает то же, что stdlib: не-строковые ключи dict становятся строками, а что orjson не умеет (int шире 64 бит) — кодируется через stdlib."""
+
+    name = "orjson"
+
+    def __init__(self) -> None:
+        import orjson
+
+        self._dumps = orjson.dumps
+        self._loads = orjson.loads
+        self._options = orjson.OPT_NON_STR_KEYS
+        self._fallback = StdlibCodec()
+
+    def dumps(self, obj: Any) -> bytes:
+        try:
+            return self._dumps(obj, option=self._options)
+        except TypeError:
+            return self._fallback.dumps(obj)
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        return self._loads(data)
+
+
+def get_codec(codec: Union[str, JsonCodec, None] = "auto") -> JsonCodec:
+    """Кодек по имени: "auto" (orjson, если установлен, иначе json), "orjson", "json". Готовый JsonCodec возвращается как есть."""
+    if isinstance(codec, JsonCodec):
+        return codec
+    if codec is None or codec == "auto":
+        try:
+            return OrjsonCodec()
+        except ImportError:
+            return StdlibCodec()
+    if codec == "json":
+        return StdlibCodec()
+    if codec == "orjson":
+        try:
+            return OrjsonCodec()
+        except ImportError:
+            raise ValueError('json_codec="orjson" requires the orjson package') from None
+    raise ValueError('json_codec must be "auto", "orjson", "json" or a JsonCodec')
@@ -0,0 +1,112 @@
+"""Команды с аргументами: "/order <int:id>" — имя команды ищется в префиксном дереве за O(длины имени), аргументы разбираются и приводятся к типу. Алиасы и сравнение без учёта регистра."""
+
+from typing import Any, Callable, Dict, Generic, List, Optional, Sequence, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# <type:name>: str — одно слово, text — весь непустой остаток строки (только последним)
+_CONVERTERS: Dict[str, Callable[[str], Any]] = {"int": int, "float": float, "str": str, "text": str}
+
+
+def _command_name(name: str) -> str:
+    return name if name.startswith("/") else "/" + name
+
+
+class CommandPattern:
+    """Разобранный шаблон "/order <int:id> pay <text:comment>". Слова без <> — литералы, должны совпасть. names — имя и алиасы; ignore_case — имя и литералы без учёта регистра."""
+
+    __slots__ = ("pattern", "names", "ignore_case", "_params")
+
+    def __init__(self, pattern: str, *, aliases: Sequence[str] = (), ignore_case: bool = False) -> None:
+        tokens = pattern.split()
+        if not tokens or not tokens[0].startswith("/") or len(tokens[0]) < 2:
+            raise ValueError('command pattern must start with "/name"')
+        if isinstance(aliases, str):
+            aliases = (aliases,)
+        self.pattern = pattern
+        self.ignore_case = ignore_case
+        self.names: Tuple[str, ...] = tuple(dict.fromkeys([tokens[0], *(_command_name(a) for a in aliases)]))
+        # (имя аргумента, тип) или (None, литерал)
+        self._params: List[Tuple[Optional[str], str]] = []
+        seen = set()
+        for i, tok in enumerate(tokens[1:], start=2):
+            if not (tok.startswith("<") and tok.endswith(">")):
+                self._params.append((None, tok.casefold() if ignore_case else tok))
+                continue
+            kind, _, name = tok[1:-1].partition(":")
+            if not name:
+                kind, name = "str", kind
+            if kind not in _CONVERTERS:
+                raise ValueError(f"unknown argument type {kind!r} in {pattern!r}")
+            if not name.isidentifier() or name in seen:
+                raise ValueError(f"bad argument name {name!r} in {pattern!r}")
+            if kind == "text" and i != len(tokens):
+                raise ValueError(f"<text:{name}> must be the last argument in {pattern!r}")
+            seen.add(name)
+            self._params.append((name, kind))
+
+    def __repr__(self) -> str:
+        return f"CommandPattern({self.pattern!r})"
+
+    def parse(self, text: str) -> Optional[Dict[str, Any]]:
+        """Аргументы из текста сообщения (первое слово — имя команды, его уже нашло дерево). None — не подходит: не хватает или лишние слова, литерал не совпал, тип не привёлся."""
+        parts = text.split(None, 1)
+        rest = parts[1] if len(parts) > 1 else ""
+        args: Dict[str, Any] = {}
+        for name, kind in self._params:
+            if not rest:
+                return None
+            if name is not None and kind == "text":
+                args[name] = rest
+                rest = ""
+                continue
+            parts = rest.split(None, 1)
+            word = parts[0]
+            rest = parts[1] if len(parts) > 1 else ""
+            if name is None:
+                if (word.casefold() if self.ignore_case else word) != kind:
+                    return None
+                continue
+            try:
+                args[name] = _CONVERTERS[kind](word)
+            except ValueError:
+                return None
+        if rest:
+            return None
+        return args
+
+
+class CommandTrie(Generic[T]):
+    """Префиксное дерево имён команд. В узле — дети по символу и значения, чьё имя здесь кончается. Имена с ignore_case лежат в отдельном дереве в casefold: поиск проходит оба дерева за O(длины слова)."""
+
+    __slots__ = ("_exact", "_folded")
+
+    def __init__(self) -> None:
+        # узел: [дети {символ: узел}, значения]
+        self._exact: List[Any] = [{}, []]
+        self._folded: List[Any] = [{}, []]
+
+    def __bool__(self) -> bool:
+        return bool(self._exact[0] or self._folded[0])
+
+    def add(self, name: str, value: T, *, ignore_case: bool = False) -> None:
+        node = self._folded if ignore_case else self._exact
+        for ch in name.casefold() if ignore_case else name:
+            children = node[0]
+            nxt = children.get(ch)
+            if nxt is None:
+                nxt = children[ch] = [{}, []]
+            node = nxt
+        node[1].append(value)
+
+    @staticmethod
+    def _walk(node: List[Any], word: str) -> List[T]:
+        for ch in word:
+            node = node[0].get(ch)
+            if node is None:
+                return []
+        return node[1]
+
+    def find(self, word: str) -> Tuple[List[T], List[T]]:
+        """Значения с точным именем word и с именем, равным word без учёта регистра."""
+        return self._walk(self._exact, word), self._walk(self._folded, word.casefold()) if self._folded[0] else []
@@ -0,0 +1,65 @@
+"""Защита от повторной доставки: кольцевой буфер последних update_id + множество для O(1) проверки. Память ограничена capacity."""
+
+import json
+import os
+from typing import Any, Hashable, List, Optional
+
+
+class SeenUpdates:
+    """Последние capacity update_id. add() — O(1): новый id вытесняет самый старый."""
+
+    __slots__ = ("_ring", "_pos", "_set")
+
+    def __init__(self, capacity: int = 10000) -> None:
+        if capacity < 1:
+            raise ValueError("capacity must be >= 1")
+        self._ring: List[Optional[Hashable]] = [None] * capacity
+        self._pos = 0
+        self._set: set = set()
+
+    def __contains__(self, update_id: Any) -> bool:
+        return update_id in self._set
+
+    def __len__(self) -> int:
+        return len(self._set)
+
+    def add(self, update_id: Hashable) -> bool:
+        """Запоминает id. True — новый, False — уже видели (дубль)."""
+        if update_id in self._set:
+            return False
+        old = self._ring[self._pos]
+        if old is not None:
+            self._set.discard(old)
+        self._ring[self._pos] = update_id
+        self._pos = (self._pos + 1) % len(self._ring)
+        self._set.add(update_id)
+        return True
+
+    def ids(self) -> List[Hashable]:
+        """id от старых к новым."""
+        ring = self._ring[self._pos:] + self._ring[:self._pos]
+        return [uid for uid in ring if uid is not None]
+
+    def save(self, path: str) -> None:
+        """Сохраняет id в файл (через временный — не оставит битый файл при падении)."""
+        self.write(path, self.ids())
+
+    @staticmethod
+    def write(path: str, ids: List[Hashable]) -> None:
+        """Пишет готовый снимок ids() — можно из другого потока, сам SeenUpdates не трогает."""
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(ids, f)
+        os.replace(tmp, path)
+
+    def load(self, path: str) -> None:
+        """Подгружает id, сохранённые save(). Нет файла или он битый — остаётся пустым."""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                ids = json.load(f)
+        except (OSError, ValueError):
+            return
+        if isinstance(ids, list):
+            for uid in ids:
+                if isinstance(uid, (int, str)):
+                    self.add(uid)
@@ -0,0 +1,118 @@
+"""Раздача updates по шардам: login → один из N долгоживущих воркеров. У пользователя обновления идут строго по порядку, разные пользователи — параллельно. Приём ограничен: при переполнении put() ждёт, залежавшиеся updates можно сбрасывать."""
+
+import asyncio
+import zlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+def update_login(update: Dict) -> str:
+    """login из update["from"] без полного разбора; нет — пустая строка (такие updates всё равно отбросит _parse_update)."""
+    user = update.get("from")
+    if isinstance(user, dict):
+        login = user.get("login")
+        if isinstance(login, str):
+            return login
+    return ""
+
+
+class ShardedDispatcher:
+    """N очередей и N воркеров. Шард выбирается по crc32(login) — стабильно между процессами и перезапусками. max_pending — предел updates в работе (в очередях + обрабатываются), None — без предела. shed_after — сколько секунд update может ждать в очереди; дольше — вместо handler вызывается on_shed(update). on_done(update) — после обработки или сброса, в том числе при ошибке хендлера."""
+
+    def __init__(
+        self,
+        handler: Callable[[Dict], Awaitable[None]],
+        shards: int,
+        log: Any,
+        *,
+        max_pending: Optional[int] = None,
+        shed_after: Optional[float] = None,
+        on_shed: Optional[Callable[[Dict], Awaitable[None]]] = None,
+        on_done: Optional[Callable[[Dict], None]] = None,
+    ) -> None:
+        if shards < 1:
+            raise ValueError("shards must be >= 1")
+        if max_pending is not None and max_pending < 1:
+            raise ValueError("max_pending must be >= 1")
+        if shed_after is not None and shed_after <= 0:
+            raise ValueError("shed_after must be > 0")
+        self._handler = handler
+        self._log = log
+        self._max_pending = max_pending
+        self._shed_after = shed_after
+        self._on_shed = on_shed
+        self._on_done = on_done
+        self._queues: List["asyncio.Queue[Tuple[Dict, float]]"] = [asyncio.Queue() for _ in range(shards)]
+        self._workers: List[asyncio.Task] = []
+        self._inflight = 0
+        self._space = asyncio.Event()
+        self._space.set()
+        self._loop = asyncio.get_running_loop()
+        self.shed_count = 0
+
+    @property
+    def pending(self) -> int:
+        """Сколько updates в работе: ждут в очередях или обрабатываются."""
+        return self._inflight
+
+    @property
+    def free(self) -> Optional[int]:
+        """Сколько ещё updates можно принять без ожидания. None — предела нет."""
+        if self._max_pending is None:
+            return None
+        return max(self._max_pending - self._inflight, 0)
+
+    def shard_of(self, login: str) -> int:
+        return zlib.crc32(login.encode("utf-8")) % len(self._queues)
+
+    def submit(self, update: Dict) -> None:
+        """Кладёт update в очередь шарда его login без ожидания, даже сверх max_pending. Проверяй free заранее."""
+        self._inflight += 1
+        if self._max_pending is not None and self._inflight >= self._max_pending:
+            self._space.clear()
+        self._queues[self.shard_of(update_login(update))].put_nowait((update, self._loop.time()))
+
+    async def put(self, update: Dict) -> None:
+        """Как submit, но при заполненном приёме ждёт, пока воркеры освободят место (backpressure)."""
+        while self._max_pending is not None and self._inflight >= self._max_pending:
+            await self._space.wait()
+        self.submit(update)
+
+    def start(self) -> None:
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker(q)) for q in self._queues]
+
+    async def _worker(self, queue: "asyncio.Queue[Tuple[Dict, float]]") -> None:
+        shed_after = self._shed_after
+        while True:
+            update, enqueued_at = await queue.get()
+            try:
+                if shed_after is not None and self._loop.time() - enqueued_at > shed_after:
+                    self.shed_count += 1
+                    if self._on_shed is not None:
+                        await self._on_shed(update)
+                else:
+                    await self._handler(update)
+            except Exception as e:
+                self._log.exception("update task: {}", e)
+            finally:
+                if self._on_done is not None:
+                    self._on_done(update)
+                queue.task_done()
+                self._inflight -= 1
+                if self._max_pending is None or self._inflight < self._max_pending:
+                    self._space.set()
+
+    async def stop(self, timeout: Optional[float] = 10.0) -> None:
+        """Ждёт, пока очереди опустеют (до timeout), потом гасит воркеров."""
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(q.join() for q in self._queues)), timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            self._log.warning("dispatcher: {} updates не обработаны к остановке", self.pending)
+        for t in self._workers:
+            t.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
@@ -0,0 +1,114 @@
+"""Синхронные и тяжёлые хендлеры вне event loop: executor="thread" — пул потоков бота, executor="process" — пул процессов. Обычная def-функция уходит в поток сама. Строка, которую вернул такой хендлер, отправляется ответом."""
+
+import asyncio
+import contextvars
+import functools
+import inspect
+import multiprocessing
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+EXECUTORS = ("thread", "process")
+
+# HandlerLimits кладёт сюда список: вызовы в пулах, которые нельзя отменить, — слот держится до их конца
+offloaded_calls: contextvars.ContextVar[Optional[List[Future]]] = contextvars.ContextVar(
+    "offloaded_calls", default=None
+)
+
+
+def is_async_handler(func: Callable) -> bool:
+    """async def, partial от неё или объект с async __call__."""
+    return inspect.iscoroutinefunction(func) or inspect.iscoroutinefunction(getattr(func, "__call__", None))
+
+
+def check_executor(func: Callable, executor: Optional[str]) -> None:
+    """ValueError при регистрации: неизвестный executor или async-хендлер, которому executor не нужен."""
+    if executor is None:
+        return
+    if executor not in EXECUTORS:
+        raise ValueError('executor must be "thread" or "process"')
+    if is_async_handler(func):
+        raise ValueError(f"executor={executor!r} is for plain def handlers, {func!r} is async")
+    if executor == "process" and "<" in getattr(func, "__qualname__", "<"):
+        # lambda и вложенные функции pickle не пересылает — ошибка сразу, а не на первом update
+        raise ValueError(f'executor="process" needs a module-level function, got {func!r}')
+
+
+def _call_in_process(func: Callable, event: Any, data: Dict[str, Any]) -> Any:
+    return func(event, **data)
+
+
+class HandlerExecutors:
+    """Пулы бота, создаются при первом хендлере, которому нужны. thread_workers / process_workers — размеры (None — по умолчанию concurrent.futures). reply(text, keyboard) — как ответить тем, что вернул хендлер."""
+
+    def __init__(
+        self,
+        reply: Callable[..., Awaitable[Any]],
+        *,
+        thread_workers: Optional[int] = None,
+        process_workers: Optional[int] = None,
+    ) -> None:
+        if thread_workers is not None and thread_workers < 1:
+            raise ValueError("thread_workers must be >= 1")
+        if process_workers is not None and process_workers < 1:
+            raise ValueError("process_workers must be >= 1")
+        self._reply = reply
+        self._thread_workers = thread_workers
+        self._process_workers = process_workers
+        self._threads: Optional[ThreadPoolExecutor] = None
+        self._processes: Optional[ProcessPoolExecutor] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _pool(self, kind: str) -> Executor:
+        if kind == "thread":
+            if self._threads is None:
+                self._threads = ThreadPoolExecutor(self._thread_workers, thread_name_prefix="bot-handler")
+            return self._threads
+        if self._processes is None:
+            # spawn, как в run_multiprocess: fork процесса с работающим loop, потоками и loguru ненадёжен
+            self._processes = ProcessPoolExecutor(
+                self._process_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._processes
+
+    def wrap(self, func: Callable, kind: str) -> Callable[..., Awaitable[Any]]:
+        """async (event, **data), который выполняет func в пуле kind и отвечает её результатом."""
+
+        async def offloaded(event: Any, **data: Any) -> Any:
+            loop = asyncio.get_running_loop()
+            self.loop = loop
+            if kind == "thread":
+                # копия контекста: Bot.current(), current_login() и reply через run_from_thread работают в потоке
+                ctx = contextvars.copy_context()
+                call = functools.partial(ctx.run, func, event, **data)
+            else:
+                # в процессе контекста бота нет: func, event и data должны пересылаться pickle
+                call = functools.partial(_call_in_process, func, event, data)
+            fut = self._pool(kind).submit(call)
+            calls = offloaded_calls.get()
+            if calls is not None:
+                calls.append(fut)
+            result = await asyncio.wrap_future(fut, loop=loop)
+            if inspect.isawaitable(result):
+                # def, вернувшая корутину, — ждём её здесь, в loop
+                result = await result
+            return await self._answer(result)
+
+        return offloaded
+
+    async def _answer(self, result: Any) -> Any:
+        if isinstance(result, str):
+            await self._reply(result)
+            return None
+        if isinstance(result, tuple) and len(result) == 2 and isinstance(result[0], str):
+            await self._reply(result[0], result[1])
+            return None
+        return result
+
+    def shutdown(self) -> None:
+        """Закрывает пулы, не дожидаясь зависших вызовов; при следующем старте пулы создадутся заново."""
+        for pool in (self._threads, self._processes):
+            if pool is not None:
+                pool.shutdown(wait=False)
+        self._threads = None
+        self._processes = None
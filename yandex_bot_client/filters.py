@@ -1,96 +1,275 @@
-"""Фильтры в стиле aiogram: F.text == \"/start\", F.callback_data.has(\"key\"), композиция через & | ~, StateFilter по FSM."""
+"""Фильтры в стиле aiogram: F.text == \"/start\", F.callback_data.has(\"key\"), композиция через & | ~, StateFilter по FSM. Фильтр — маленькое дерево выражения: диспетчер достаёт из него равенства по text, state и ключам payload для индекса, дешёвые проверки ставит первыми и считает всё по одному разобранному update."""
 
-from typing import Any, Callable, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple, Union
 
-from .client import Bot
-from .fsm import get_state
+from .types import ParsedUpdate
 
+# Измерения индекса: text → строки, state → состояния, callback → пары (ключ payload, значение).
+Keys = Dict[str, FrozenSet[Any]]
 
-def _text_eq(value: str) -> Callable[[Dict], bool]:
-    """Текст сообщения (после strip) равен value."""
 
-    def _check(update: Dict) -> bool:
-        text = (update.get("text") or "").strip()
-        return text == value
+# Фильтры считаются по разобранному update — тому же объекту, что у Message.parsed / CallbackQuery.parsed.
+FilterContext = ParsedUpdate
 
-    return _check
 
+class Filter:
+    """Узел дерева фильтра. Filter(func) — непрозрачная проверка (update) -> bool (у callback — (update, payload)). Комбинируется через & | ~; вызывается как функция: filter(update) или filter(update, payload)."""
 
-def _callback_has(key: str) -> Callable[[Dict, Dict], bool]:
-    """В payload кнопки есть ключ key."""
+    # относительная цена проверки: в & дешёвые идут первыми
+    cost = 10
 
-    def _check(update: Dict, payload: Dict) -> bool:
-        return key in (payload or {})
+    def __init__(self, func: Optional[Callable[..., bool]] = None) -> None:
+        self._func = func
+        self._compiled: Optional[Callable[[FilterContext], bool]] = None
 
-    return _check
+    def compile(self) -> Callable[[FilterContext], bool]:
+        """Проверка по FilterContext — то, что вызывает диспетчер."""
+        func = self._func
 
+        def _check(ctx: FilterContext) -> bool:
+            return bool(func(ctx.update) if ctx.payload is None else func(ctx.update, ctx.payload))
 
-def _callback_eq(key: str, value: Any) -> Callable[[Dict, Dict], bool]:
-    """payload[key] == value."""
+        return _check
 
-    def _check(update: Dict, payload: Dict) -> bool:
-        return (payload or {}).get(key) == value
+    def keys(self) -> Keys:
+        """Какие значения text / state / (ключ, значение) payload обязательны для срабатывания. Нет измерения — ограничений нет."""
+        return {}
 
-    return _check
+    def __call__(self, update: Dict, payload: Optional[Dict] = None) -> bool:
+        if self._compiled is None:
+            self._compiled = self.compile()
+        return self._compiled(FilterContext.from_update(update, payload))
 
+    def __and__(self, other: Union["Filter", Callable[..., bool]]) -> "Filter":
+        return _And([self, as_filter(other)])
 
-class Filter:
-    """Обёртка над (update) -> bool: можно комбинировать через & | ~. Вызывается как функция: filter(update)."""
+    def __rand__(self, other: Callable[..., bool]) -> "Filter":
+        return _And([as_filter(other), self])
 
-    def __init__(self, func: Callable[[Dict], bool]) -> None:
-        self._func = func
+    def __or__(self, other: Union["Filter", Callable[..., bool]]) -> "Filter":
+        return _Or([self, as_filter(other)])
 
-    def __call__(self, update: Dict) -> bool:
-        return self._func(update)
+    def __ror__(self, other: Callable[..., bool]) -> "Filter":
+        return _Or([as_filter(other), self])
 
-    def __and__(self, other: Union["Filter", Callable[[Dict], bool]]) -> "Filter":
-        if isinstance(other, Filter):
-            other = other._func
-        return Filter(lambda u: self._func(u) and other(u))
+    def __invert__(self) -> "Filter":
+        return _Not(self)
 
-    def __or__(self, other: Union["Filter", Callable[[Dict], bool]]) -> "Filter":
-        if isinstance(other, Filter):
-            other = other._func
-        return Filter(lambda u: self._func(u) or other(u))
 
-    def __invert__(self) -> "Filter":
-        return Filter(lambda u: not self._func(u))
+def as_filter(f: Union[Filter, Callable[..., bool]]) -> Filter:
+    """Filter как есть, обычную функцию — в непрозрачный Filter."""
+    return f if isinstance(f, Filter) else Filter(f)
+
+
+def compile_filter(f: Optional[Union[Filter, Callable[..., bool]]]) -> Optional[Callable[[FilterContext], bool]]:
+    """Фильтр хендлера → проверка по FilterContext. None — без фильтра."""
+    if f is None:
+        return None
+    return as_filter(f).compile()
+
+
+def filter_keys(f: Optional[Union[Filter, Callable[..., bool]]]) -> Keys:
+    """Обязательные значения для индекса; у обычной функции — никаких."""
+    return f.keys() if isinstance(f, Filter) else {}
+
+
+class _TextEq(Filter):
+    cost = 1
+
+    def __init__(self, value: str) -> None:
+        super().__init__()
+        self.value = value
+
+    def compile(self) -> Callable[[FilterContext], bool]:
+        value = self.value
+        return lambda ctx: ctx.text == value
+
+    def keys(self) -> Keys:
+        return {"text": frozenset((self.value,))}
+
+
+class _StateIn(Filter):
+    cost = 2
+
+    def __init__(self, allowed: FrozenSet[str]) -> None:
+        super().__init__()
+        self.allowed = allowed
+
+    def compile(self) -> Callable[[FilterContext], bool]:
+        allowed = self.allowed
+        return lambda ctx: ctx.bot is not None and ctx.login is not None and ctx.state in allowed
+
+    def keys(self) -> Keys:
+        return {"state": self.allowed}
+
+
+class _TextPrefix(Filter):
+    cost = 1
+
+    def __init__(self, prefix: str) -> None:
+        super().__init__()
+        self.prefix = prefix
+
+    def compile(self) -> Callable[[FilterContext], bool]:
+        prefix = self.prefix
+        return lambda ctx: ctx.text.startswith(prefix)
+
+
+class _StatePrefix(Filter):
+    cost = 2
+
+    def __init__(self, prefix: str) -> None:
+        super().__init__()
+        self.prefix = prefix
+
+    def compile(self) -> Callable[[FilterContext], bool]:
+        prefix = self.prefix
+
+        def _check(ctx: FilterContext) -> bool:
+            state = ctx.state
+            return isinstance(state, str) and state.startswith(prefix)
+
+        return _check
+
+
+class _CallbackHas(Filter):
+    cost = 1
+
+    def __init__(self, key: str) -> None:
+        super().__init__()
+        self.key = key
+
+    def compile(self) -> Callable[[FilterContext], bool]:
+        key = self.key
+        return lambda ctx: key in (ctx.payload or {})
+
+
+class _CallbackEq(Filter):
+    cost = 1
+
+    def __init__(self, key: str, value: Any) -> None:
+        super().__init__()
+        self.key = key
+        self.value = value
+
+    def compile(self) -> Callable[[FilterContext], bool]:
+        key, value = self.key, self.value
+        return lambda ctx: (ctx.payload or {}).get(key) == value
+
+    def keys(self) -> Keys:
+        try:
+            return {"callback": frozenset(((self.key, self.value),))}
+        except TypeError:
+            # нехешируемое значение в индекс не попадает — проверяется перебором
+            return {}
+
+
+class _And(Filter):
+    def __init__(self, children: List[Filter]) -> None:
+        super().__init__()
+        # (a & b) & c — один плоский узел
+        self.children: List[Filter] = []
+        for c in children:
+            self.children.extend(c.children if isinstance(c, _And) else [c])
+        self.cost = sum(c.cost for c in self.children)
+
+    def compile(self) -> Callable[[FilterContext], bool]:
+        # sorted устойчив: при равной цене — порядок из выражения
+        checks = tuple(c.compile() for c in sorted(self.children, key=lambda c: c.cost))
+
+        def _all(ctx: FilterContext) -> bool:
+            for check in checks:
+                if not check(ctx):
+                    return False
+            return True
+
+        return _all
+
+    def keys(self) -> Keys:
+        keys: Keys = {}
+        for c in self.children:
+            for dim, values in c.keys().items():
+                if dim not in keys:
+                    keys[dim] = values
+                elif dim == "callback":
+                    # пары разных ключей payload не пересекаются — хватит самого узкого набора
+                    keys[dim] = min(keys[dim], values, key=len)
+                else:
+                    keys[dim] = keys[dim] & values
+        return keys
+
+
+class _Or(Filter):
+    def __init__(self, children: List[Filter]) -> None:
+        super().__init__()
+        self.children: List[Filter] = []
+        for c in children:
+            self.children.extend(c.children if isinstance(c, _Or) else [c])
+        self.cost = sum(c.cost for c in self.children)
+
+    def compile(self) -> Callable[[FilterContext], bool]:
+        checks = tuple(c.compile() for c in sorted(self.children, key=lambda c: c.cost))
+
+        def _any(ctx: FilterContext) -> bool:
+            for check in checks:
+                if check(ctx):
+                    return True
+            return False
+
+        return _any
+
+    def keys(self) -> Keys:
+        # измерение ограничено, только если ограничена каждая ветка
+        child_keys = [c.keys() for c in self.children]
+        keys: Keys = {}
+        for dim in set(child_keys[0]) if child_keys else ():
+            if all(dim in k for k in child_keys):
+                keys[dim] = frozenset().union(*(k[dim] for k in child_keys))
+        return keys
+
+
+class _Not(Filter):
+    def __init__(self, child: Filter) -> None:
+        super().__init__()
+        self.child = child
+        self.cost = child.cost
+
+    def compile(self) -> Callable[[FilterContext], bool]:
+        check = self.child.compile()
+        return lambda ctx: not check(ctx)
 
 
 def StateFilter(
     state_or_states: Union[str, List[str], tuple],
 ) -> Filter:
-    """Фильтр по текущему FSM-состоянию. state_or_states — одна строка или список допустимых. Берёт Bot.current() и login из update."""
+    """Фильтр по текущему FSM-состоянию. state_or_states — одна строка или список допустимых. state берётся из контекста update один раз на все фильтры."""
     if isinstance(state_or_states, str):
-        allowed = {state_or_states}
+        allowed = frozenset((state_or_states,))
     else:
-        allowed = set(state_or_states)
+        allowed = frozenset(state_or_states)
+    return _StateIn(allowed)
 
-    def _check(update: Dict) -> bool:
-        bot = Bot.current()
-        if not bot:
-            return False
-        user = update.get("from") if isinstance(update.get("from"), dict) else {}
-        login = user.get("login") if user else None
-        if not login:
-            return False
-        return get_state(bot, login) in allowed
 
-    return Filter(_check)
+def StatePrefix(prefix: str) -> Filter:
+    """Фильтр: текущее FSM-состояние начинается с prefix (например, все состояния "order:...")."""
+    return _StatePrefix(prefix)
 
 
 class _TextFilter:
-    """F.text == \"...\" — возвращает Filter, можно комбинировать с & | ~."""
+    """F.text == \"...\" и F.text.startswith(\"...\") — возвращают Filter, можно комбинировать с & | ~."""
 
-    def __eq__(self, value: object) -> Filter:
-        return Filter(_text_eq(str(value)))
+    def __eq__(self, value: object) -> Filter:  # type: ignore[override]
+        return _TextEq(str(value))
+
+    def startswith(self, prefix: str) -> Filter:
+        return _TextPrefix(prefix)
 
 
 class _CallbackDataFilter:
     """F.callback_data.has(\"key\") и F.callback_data[\"key\"] == value."""
 
-    def has(self, key: str) -> Callable[[Dict, Dict], bool]:
-        return _callback_has(key)
+    def has(self, key: str) -> Filter:
+        return _CallbackHas(key)
 
     def __getitem__(self, key: str) -> "_CallbackDataKey":
         return _CallbackDataKey(key)
@@ -100,12 +279,12 @@ class _CallbackDataKey:
     def __init__(self, key: str) -> None:
         self._key = key
 
-    def __eq__(self, value: object) -> Callable[[Dict, Dict], bool]:
-        return _callback_eq(self._key, value)
+    def __eq__(self, value: object) -> Filter:  # type: ignore[override]
+        return _CallbackEq(self._key, value)
 
 
 class F:
-    """F.text == \"/start\" — точный текст. F.callback_data.has(\"cmd\") — есть ключ в payload. F.callback_data[\"hash\"] == \"abc\" — значение по ключу."""
+    """F.text == \"/start\" — точный текст, F.text.startswith(\"/admin\") — начало текста. F.callback_data.has(\"cmd\") — есть ключ в payload. F.callback_data[\"hash\"] == \"abc\" — значение по ключу."""
 
     text: _TextFilter = _TextFilter()
     callback_data: _CallbackDataFilter = _CallbackDataFilter()
@@ -113,21 +292,21 @@ class F:
 
 def and_f(
     *filters: Callable[..., bool],
-) -> Callable[..., bool]:
+) -> Filter:
     """Склеивает фильтры через AND. Для message — один арг (update), для callback — (update, payload)."""
-
-    def _combined(*args: Any, **kwargs: Any) -> bool:
-        return all(f(*args, **kwargs) for f in filters)
-
-    return _combined
+    return _And([as_filter(f) for f in filters])
 
 
 def or_f(
     *filters: Callable[..., bool],
-) -> Callable[..., bool]:
+) -> Filter:
     """Склеивает фильтры через OR."""
+    return _Or([as_filter(f) for f in filters])
 
-    def _combined(*args: Any, **kwargs: Any) -> bool:
-        return any(f(*args, **kwargs) for f in filters)
 
-    return _combined
+def index_keys(keys: Keys, dim: str) -> Tuple[Any, ...]:
+    """Значения измерения для корзин индекса; (None,) — «любое». None среди значений (StateFilter([None, "x"])) — тоже «любое»: иначе хендлер попал бы в две корзины одного поиска и вызвался дважды."""
+    values = keys.get(dim)
+    if not values or None in values:
+        return (None,)
+    return tuple(values)
@@ -1,4 +1,4 @@
-"""FSM по пользователю: состояния в bot._fsm_states, отдельно от bot.state(login), чтобы не пересекаться с твоими ключами."""
+"""FSM по пользователю: состояния в хранилище бота (Bot(storage=...)), отдельно от bot.state(login), чтобы не пересекаться с твоими ключами."""
 
 from typing import TYPE_CHECKING, Optional
 
@@ -14,18 +14,15 @@ class State:
 
 def get_state(bot: "Bot", login: str) -> Optional[str]:
     """Текущее FSM-состояние пользователя. None, если не задано."""
-    return getattr(bot, "_fsm_states", {}).get(login)
+    storage = getattr(bot, "_storage", None)
+    return storage.get_state(login) if storage is not None else None
 
 
 def set_state(bot: "Bot", login: str, state: Optional[str]) -> None:
     """Ставит FSM-состояние. state=None — сброс."""
-    storage = getattr(bot, "_fsm_states", None)
-    if storage is None:
-        return
-    if state is None:
-        storage.pop(login, None)
-    else:
-        storage[login] = state
+    storage = getattr(bot, "_storage", None)
+    if storage is not None:
+        storage.set_state(login, state)
 
 
 def clear_state(bot: "Bot", login: str) -> None:
@@ -0,0 +1,265 @@
+"""Скомпилированные таблицы хендлеров: вместо перебора всех message/button/default хендлеров на каждый update — хеш-поиск по text, action и state. Порядок регистрации (первый подходящий) сохраняется. Дерево роутеров разворачивается здесь же: цепочки middleware собираются один раз на хендлер, guard'ы роутеров становятся общими для поддерева проверками."""
+
+import heapq
+from operator import itemgetter
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .commands import CommandPattern, CommandTrie
+from .executors import HandlerExecutors, is_async_handler
+from .filters import Filter, FilterContext, and_f, compile_filter, filter_keys, index_keys
+from .middleware import Handler, Middleware, compile_chain, compile_handler
+
+_Entry = Dict[str, Any]
+
+
+_TABLES = ("_handlers", "_button_handlers", "_default_handlers", "_callback_handlers")
+
+
+def router_mark(node: Any) -> Tuple[int, ...]:
+    """Сколько своих хендлеров у узла в каждой таблице — место роутера, подключаемого к нему сейчас."""
+    return tuple(len(getattr(node, name)) for name in _TABLES)
+
+
+class CompiledHandler:
+    """Хендлер из таблицы бота с готовым вызовом: call(event, data) проходит middlewares и вызывает func. check(ctx) — фильтр по FilterContext (None — без фильтра), keys — обязательные значения из фильтра и guard'ов для индекса, guards — номера guard'ов роутеров над хендлером (снаружи внутрь)."""
+
+    __slots__ = ("entry", "check", "keys", "guards", "command", "call")
+
+    def __init__(
+        self,
+        entry: _Entry,
+        middlewares: Sequence[Middleware],
+        guards: Tuple[int, ...] = (),
+        scope: Sequence[Filter] = (),
+        executors: Optional[HandlerExecutors] = None,
+    ) -> None:
+        self.entry = entry
+        f = entry.get("filter")
+        self.check: Optional[Callable[[FilterContext], bool]] = compile_filter(f)
+        # guard роутера сужает хендлер так же, как & в его фильтре
+        self.keys = filter_keys(and_f(*scope, f) if f is not None else and_f(*scope)) if scope else filter_keys(f)
+        self.guards = guards
+        self.command: Optional[CommandPattern] = entry.get("command")
+        func = entry["func"]
+        executor = entry.get("executor")
+        if executor is None and not is_async_handler(func):
+            executor = "thread"
+        if executor is not None and executors is not None:
+            func = executors.wrap(func, executor)
+        limits = entry.get("limits")
+        if limits is not None:
+            func = limits.wrap(func)
+        self.call: Handler = compile_handler(middlewares, func)
+
+
+class _Table:
+    """Хендлеры с двумя ключами — primary (text или action) и state; None в хендлере — «любой». Не задан в хендлере — берётся из равенств его фильтра (F.text == ..., StateFilter); хендлер с несколькими значениями лежит в нескольких корзинах. Кандидаты для пары ключей — слияние до четырёх корзин по позиции регистрации, результат кешируется."""
+
+    __slots__ = ("_buckets", "_primaries", "_states", "_cache")
+
+    def __init__(self, items: List[Tuple[int, CompiledHandler]], primary: Optional[str]) -> None:
+        self._buckets: Dict[Tuple[Any, Any], List[Tuple[int, CompiledHandler]]] = {}
+        self._primaries: set = set()
+        self._states: set = set()
+        for pos, item in items:
+            p = item.entry.get(primary) if primary else None
+            primaries = (p,) if p is not None else index_keys(item.keys, "text") if primary == "text" else (None,)
+            st = item.entry.get("state")
+            states = (st,) if st is not None else index_keys(item.keys, "state")
+            for p in primaries:
+                for st in states:
+                    self._buckets.setdefault((p, st), []).append((pos, item))
+            self._primaries.update(p for p in primaries if p is not None)
+            self._states.update(st for st in states if st is not None)
+        # ключи кеша — только известные text/action/state или None, поэтому он не растёт от пользовательского ввода
+        self._cache: Dict[Tuple[Any, Any], Tuple[List[Tuple[int, CompiledHandler]], List[CompiledHandler]]] = {}
+
+    def lookup_positions(self, primary: Any, state: Any) -> List[Tuple[int, CompiledHandler]]:
+        """Как lookup, но пары (позиция регистрации, хендлер) — для слияния с другими таблицами."""
+        return self._lookup(primary, state)[0]
+
+    def lookup(self, primary: Any, state: Any) -> List[CompiledHandler]:
+        """Хендлеры, чьи text/action и state подходят, в порядке регистрации. Фильтры не проверяются."""
+        return self._lookup(primary, state)[1]
+
+    def _lookup(
+        self, primary: Any, state: Any
+    ) -> Tuple[List[Tuple[int, CompiledHandler]], List[CompiledHandler]]:
+        p = primary if primary in self._primaries else None
+        st = state if state in self._states else None
+        key = (p, st)
+        found = self._cache.get(key)
+        if found is None:
+            parts = [self._buckets[k] for k in {(p, st), (p, None), (None, st), (None, None)} if k in self._buckets]
+            pairs = list(heapq.merge(*parts, key=itemgetter(0)))
+            found = self._cache[key] = (pairs, [h for _, h in pairs])
+        return found
+
+
+class _CommandTable:
+    """command_handler'ы: имя команды и алиасы — в CommandTrie, state отсекается здесь же. Аргументы разбирает вызывающий (CompiledHandler.command.parse)."""
+
+    __slots__ = ("_trie",)
+
+    def __init__(self, items: List[Tuple[int, CompiledHandler]]) -> None:
+        self._trie: CommandTrie[Tuple[int, CompiledHandler, Optional[frozenset]]] = CommandTrie()
+        for pos, item in items:
+            st = item.entry.get("state")
+            states = (st,) if st is not None else index_keys(item.keys, "state")
+            allowed = None if None in states else frozenset(states)
+            command = item.command
+            for name in command.names:
+                self._trie.add(name, (pos, item, allowed), ignore_case=command.ignore_case)
+
+    def __bool__(self) -> bool:
+        return bool(self._trie)
+
+    def lookup(self, text: str, state: Any) -> List[Tuple[int, CompiledHandler]]:
+        """Хендлеры команды — первого слова text — для state, в порядке регистрации."""
+        word = text.split(None, 1)[0] if text else ""
+        if not word.startswith("/"):
+            return []
+        exact, folded = self._trie.find(word)
+        found = [(pos, h) for pos, h, allowed in exact if allowed is None or state in allowed]
+        if folded:
+            found.extend((pos, h) for pos, h, allowed in folded if allowed is None or state in allowed)
+            # имя и алиас одного хендлера могут совпасть оба
+            found = sorted(dict(found).items())
+        return found
+
+
+class _CallbackTable:
+    """callback_handler'ы: с равенством F.callback_data[key] == value в фильтре — в корзине (key, value), остальные перебираются всегда."""
+
+    __slots__ = ("_by_key", "_always", "_always_items")
+
+    def __init__(self, items: List[CompiledHandler]) -> None:
+        self._by_key: Dict[Any, Dict[Any, List[Tuple[int, CompiledHandler]]]] = {}
+        self._always: List[Tuple[int, CompiledHandler]] = []
+        for pos, item in enumerate(items):
+            pairs = item.keys.get("callback")
+            if not pairs:
+                self._always.append((pos, item))
+                continue
+            for key, value in pairs:
+                self._by_key.setdefault(key, {}).setdefault(value, []).append((pos, item))
+        self._always_items = [item for _, item in self._always]
+
+    def lookup(self, payload: Dict[str, Any]) -> List[CompiledHandler]:
+        """Кандидаты для payload в порядке регистрации. Фильтры не проверяются."""
+        parts = []
+        for key, by_value in self._by_key.items():
+            value = payload.get(key)
+            try:
+                bucket = by_value.get(value)
+            except TypeError:
+                continue
+            if bucket:
+                parts.append(bucket)
+        if not parts:
+            return self._always_items
+        parts.append(self._always)
+        found = []
+        last = -1
+        for pos, item in heapq.merge(*parts, key=itemgetter(0)):
+            # хендлер с условием на несколько ключей может попасть сюда из двух корзин
+            if pos != last:
+                found.append(item)
+                last = pos
+        return found
+
+
+class HandlerIndex:
+    """Снимок дерева хендлеров бота: сам бот и его роутеры (у обоих — _handlers, _button_handlers, _default_handlers, _callback_handlers, _middlewares, _routers, _router_marks; у роутера ещё _guard). Порядок — порядок регистрации: хендлеры роутера встают между хендлерами узла туда, где был вызван include_router. signature меняется от нового хендлера, роутера или middleware в любом месте дерева — индекс пересобирается."""
+
+    __slots__ = (
+        "signature", "guard_checks", "_messages", "_commands", "_buttons", "_defaults", "_callbacks",
+        "outer_message", "outer_callback",
+    )
+
+    def __init__(self, root: Any, *, dispatch_message: Handler, dispatch_callback: Handler) -> None:
+        self.signature = self.signature_of(root)
+        executors: Optional[HandlerExecutors] = getattr(root, "_executors", None)
+        self.guard_checks: List[Callable[[FilterContext], bool]] = []
+        tables: Dict[str, List[CompiledHandler]] = {name: [] for name in _TABLES}
+        self._walk(root, (), (), (), tables, executors)
+        messages = list(enumerate(tables["_handlers"]))
+        # message_handler'ы и command_handler'ы — один список с общим порядком регистрации
+        self._messages = _Table([(pos, h) for pos, h in messages if h.command is None], "text")
+        self._commands = _CommandTable([(pos, h) for pos, h in messages if h.command is not None])
+        self._buttons = _Table(list(enumerate(tables["_button_handlers"])), "action")
+        self._defaults = _Table(list(enumerate(tables["_default_handlers"])), None)
+        self._callbacks = _CallbackTable(tables["_callback_handlers"])
+        # outer-middlewares — вокруг всего подбора хендлера, один раз на update
+        outer = root._outer_middlewares
+        self.outer_message: Handler = compile_chain(outer, dispatch_message)
+        self.outer_callback: Handler = compile_chain(outer, dispatch_callback)
+
+    def _walk(
+        self,
+        node: Any,
+        middlewares: Tuple[Middleware, ...],
+        guards: Tuple[int, ...],
+        scope: Tuple[Filter, ...],
+        tables: Dict[str, List[CompiledHandler]],
+        executors: Optional[HandlerExecutors],
+    ) -> None:
+        middlewares = middlewares + tuple(node._middlewares)
+        guard = getattr(node, "_guard", None)
+        if guard is not None:
+            self.guard_checks.append(guard.compile())
+            guards = guards + (len(self.guard_checks) - 1,)
+            scope = scope + (guard,)
+        done = [0] * len(_TABLES)
+
+        def own_until(mark: Tuple[int, ...]) -> None:
+            for i, name in enumerate(_TABLES):
+                tables[name].extend(
+                    CompiledHandler(h, middlewares, guards, scope, executors)
+                    for h in getattr(node, name)[done[i]:mark[i]]
+                )
+                done[i] = max(done[i], mark[i])
+
+        for child, mark in zip(node._routers, node._router_marks):
+            own_until(mark)
+            self._walk(child, middlewares, guards, scope, tables, executors)
+        own_until(router_mark(node))
+
+    @staticmethod
+    def signature_of(root: Any) -> Tuple[int, ...]:
+        # роутеры сами считают изменения своих поддеревьев — обходить дерево на каждый update не нужно
+        own = tuple(len(getattr(root, name)) for name in _TABLES)
+        return own + (len(root._middlewares), len(root._outer_middlewares)) + tuple(r._changes for r in root._routers)
+
+    def admits(self, h: CompiledHandler, ctx: FilterContext, verdicts: Dict[int, bool]) -> bool:
+        """Прошёл ли update guard'ы роутеров над хендлером. verdicts — кеш на один update: guard считается один раз на всё поддерево."""
+        for g in h.guards:
+            ok = verdicts.get(g)
+            if ok is None:
+                ok = verdicts[g] = bool(self.guard_checks[g](ctx))
+            if not ok:
+                return False
+        return True
+
+    def messages(self, text: str, state: Optional[str]) -> List[CompiledHandler]:
+        """message_handler-кандидаты: text совпал или не задан, state совпал или не задан; плюс command_handler'ы по первому слову. filter и аргументы команды проверяет вызывающий."""
+        if not self._commands:
+            return self._messages.lookup(text, state)
+        commands = self._commands.lookup(text, state)
+        if not commands:
+            return self._messages.lookup(text, state)
+        return [h for _, h in heapq.merge(self._messages.lookup_positions(text, state), commands, key=itemgetter(0))]
+
+    def buttons(self, action: str, state: Optional[str]) -> List[CompiledHandler]:
+        """button_handler'ы с этим action и подходящим state."""
+        if action not in self._buttons._primaries:
+            return []
+        return self._buttons.lookup(action, state)
+
+    def defaults(self, state: Optional[str]) -> List[CompiledHandler]:
+        """default_handler'ы для state."""
+        return self._defaults.lookup(None, state)
+
+    def callbacks(self, payload: Dict[str, Any]) -> List[CompiledHandler]:
+        """callback_handler-кандидаты для payload. filter проверяет вызывающий."""
+        return self._callbacks.lookup(payload)
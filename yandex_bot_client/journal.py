@@ -0,0 +1,151 @@
+"""Журнал входящих updates: переживает падение и деплой. Append-only JSON lines — r (получен), d (обработан), o (offset). На диск пишется пачками с fsync, не на каждое сообщение."""
+
+import asyncio
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from .codec import JsonCodec, StdlibCodec
+
+# После стольких байт журнал переписывается: offset и только незавершённые updates.
+_COMPACT_BYTES = 16 * 1024 * 1024
+
+
+class UpdateJournal:
+    """record()/done() только копят строки в памяти; commit() дописывает их в файл и делает fsync. Фоново commit() идёт раз в flush_interval."""
+
+    def __init__(
+        self, path: str, *, flush_interval: float = 0.5, log: Any = None, codec: Optional[JsonCodec] = None
+    ) -> None:
+        if flush_interval <= 0:
+            raise ValueError("flush_interval must be > 0")
+        self.path = path
+        self._flush_interval = flush_interval
+        self._log = log
+        self._codec = codec or StdlibCodec()
+        self._buffer: List[bytes] = []
+        # незавершённые updates целиком — чтобы ужать файл, не перечитывая его
+        self._pending: Dict[int, Dict] = {}
+        self._compact_at = _COMPACT_BYTES
+        self._offset = 0
+        self._size = 0
+        self._file: Any = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._flusher: Optional[asyncio.Task] = None
+
+    @property
+    def offset(self) -> int:
+        """Последний update_id, записанный в журнал."""
+        return self._offset
+
+    def open(self) -> Tuple[List[Dict], int]:
+        """Читает журнал: незавершённые updates (в порядке получения) и offset. Сразу переписывает файл только с ними — журнал не растёт между запусками."""
+        received: Dict[int, Dict] = {}
+        offset = 0
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                for line in f:
+                    try:
+                        rec = self._codec.loads(line)
+                    except ValueError:
+                        # хвост, недописанный при падении
+                        continue
+                    if not isinstance(rec, dict):
+                        continue
+                    if "r" in rec:
+                        uid = rec["r"].get("update_id")
+                        if isinstance(uid, int):
+                            received[uid] = rec["r"]
+                            offset = max(offset, uid)
+                    elif "d" in rec:
+                        received.pop(rec["d"], None)
+                    elif "o" in rec:
+                        offset = max(offset, rec["o"])
+        pending = [received[uid] for uid in sorted(received)]
+        self._lock = asyncio.Lock()
+        self._offset = offset
+        self._pending = dict(received)
+        dumps = self._codec.dumps
+        self._rewrite([dumps({"o": offset})] + [dumps({"r": u}) for u in pending])
+        return pending, offset
+
+    def _rewrite(self, lines: List[bytes]) -> None:
+        if self._file is not None:
+            self._file.close()
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            for line in lines:
+                f.write(line + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self._file = open(self.path, "ab")
+        self._size = self._file.tell()
+
+    def record(self, update: Dict) -> None:
+        """update получен — в буфер. На диске окажется при ближайшем commit()."""
+        # сначала кодирование: ошибка не оставит update в pending без строки в файле
+        line = self._codec.dumps({"r": update})
+        uid = update.get("update_id")
+        if isinstance(uid, int):
+            self._pending[uid] = update
+            self._offset = max(self._offset, uid)
+        self._buffer.append(line)
+
+    def done(self, update_id: Any) -> None:
+        """update обработан — в буфер. Потеря этой отметки при падении даст повтор, но не потерю."""
+        if isinstance(update_id, int):
+            self._pending.pop(update_id, None)
+            self._buffer.append(self._codec.dumps({"d": update_id}))
+
+    def _write(self, lines: List[bytes], snapshot: Optional[List[bytes]]) -> None:
+        """Выполняется в пуле потоков: дописать и fsync; snapshot — переписать файл только им."""
+        data = b"\n".join(lines) + b"\n"
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._size += len(data)
+        if snapshot is not None:
+            self._rewrite(snapshot)
+            # снимок сам может быть большим — следующее сжатие, когда файл вырастет вдвое
+            self._compact_at = max(_COMPACT_BYTES, 2 * self._size)
+
+    async def commit(self) -> None:
+        """Сбрасывает буфер на диск одной записью с fsync. Пустой буфер — ничего не делает; если идёт запись, ждёт её: в ней могут быть и строки вызывающего."""
+        if self._file is None or not (self._buffer or self._lock.locked()):
+            return
+        async with self._lock:
+            lines, self._buffer = self._buffer, []
+            if not lines:
+                return
+            snapshot = None
+            if self._size > self._compact_at:
+                # снимок в loop: record/done меняют _pending, пока поток пишет
+                dumps = self._codec.dumps
+                pending = self._pending
+                snapshot = [dumps({"o": self._offset})] + [dumps({"r": pending[uid]}) for uid in sorted(pending)]
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._write, lines, snapshot)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            try:
+                await self.commit()
+            except Exception as e:
+                if self._log is not None:
+                    self._log.exception("journal commit: {}", e)
+
+    def start(self) -> None:
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def close(self) -> None:
+        """Последний commit и закрытие файла."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.commit()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -1,6 +1,80 @@
 """Сборка inline-клавиатур и helper для мультивыбора."""
 
-from typing import Any, Dict, List, Optional, Sequence, Set
+import bisect
+import copy
+import json
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple, Union
+
+if TYPE_CHECKING:
+    from .codec import JsonCodec
+
+
+def flatten_rows(
+    rows: Sequence[Sequence[Dict[str, Any]]], loads: Callable[[str], Any] = json.loads
+) -> List[Dict[str, Any]]:
+    """Ряды кнопок → формат API: плоский список {"text", "callback_data", "url"}. callback_data строкой разбирается loads."""
+    flat = []
+    for row in rows:
+        for btn in row:
+            b = {"text": btn.get("text", "")}
+            cd = btn.get("callback_data") or btn.get("callbackData")
+            if cd is not None:
+                b["callback_data"] = cd if isinstance(cd, dict) else loads(cd) if isinstance(cd, str) else cd
+            url = btn.get("url")
+            if isinstance(url, str) and url.strip():
+                b["url"] = url.strip()
+            flat.append(b)
+    return flat
+
+
+class FrozenKeyboard:
+    """Неизменяемая клавиатура из Keyboard.freeze(): кнопки уже в формате API, JSON собирается один раз на кодек и дальше вставляется в тело запроса как есть. Держи в модуле и передавай в send_message/reply вместо build()."""
+
+    __slots__ = ("_rows", "_flat", "_encoded")
+
+    def __init__(self, rows: Sequence[Sequence[Dict[str, Any]]]) -> None:
+        # своя глубокая копия: изменения исходных dict'ов кнопок не просочатся в готовый JSON
+        object.__setattr__(self, "_rows", tuple(tuple(copy.deepcopy(b) for b in row) for row in rows))
+        object.__setattr__(self, "_flat", flatten_rows(self._rows))
+        object.__setattr__(self, "_encoded", None)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError("FrozenKeyboard is immutable")
+
+    def __reduce__(self) -> Any:
+        # pickle по умолчанию восстанавливает слоты через __setattr__ — а он запрещён; собираем заново из рядов
+        return (FrozenKeyboard, (self._rows,))
+
+    def __bool__(self) -> bool:
+        return bool(self._flat)
+
+    def __len__(self) -> int:
+        """Число кнопок."""
+        return len(self._flat)
+
+    @property
+    def rows(self) -> List[List[Dict[str, Any]]]:
+        """Копия рядов в формате Keyboard.build()."""
+        return [[copy.deepcopy(b) for b in row] for row in self._rows]
+
+    def for_api(self) -> List[Dict[str, Any]]:
+        """Копия плоского списка кнопок в формате API."""
+        return copy.deepcopy(self._flat)
+
+    def encoded(self, codec: "JsonCodec") -> bytes:
+        """JSON плоского списка кнопок. Считается при первой отправке и кешируется (на последний использованный кодек)."""
+        cached = self._encoded
+        if cached is None or cached[0] is not codec:
+            cached = (codec, codec.dumps(self._flat))
+            object.__setattr__(self, "_encoded", cached)
+        return cached[1]
+
+    def __repr__(self) -> str:
+        return f"FrozenKeyboard({len(self._rows)} rows, {len(self._flat)} buttons)"
+
+
+# keyboard= у send_message / reply / edit_message_text / broadcast
+KeyboardLike = Union[List[List[Dict[str, Any]]], FrozenKeyboard]
 
 
 class Keyboard:
@@ -8,6 +82,7 @@ class Keyboard:
 
     def __init__(self) -> None:
         self._rows: List[List[Dict[str, Any]]] = []
+        self._frozen: Optional[FrozenKeyboard] = None
 
     @staticmethod
     def button(
@@ -29,12 +104,19 @@ class Keyboard:
     def row(self, *buttons: Dict[str, Any]) -> "Keyboard":
         """Добавляет ряд кнопок. Можно несколько кнопок в один ряд. Возвращает self для цепочки."""
         self._rows.append(list(buttons))
+        self._frozen = None
         return self
 
     def build(self) -> List[List[Dict[str, Any]]]:
         """Готовый формат для send_message(..., keyboard=...)."""
         return self._rows
 
+    def freeze(self) -> FrozenKeyboard:
+        """Неизменяемая копия для частых отправок: разворачивается и сериализуется один раз. Повторный вызов без новых row() вернёт тот же объект."""
+        if self._frozen is None:
+            self._frozen = FrozenKeyboard(self._rows)
+        return self._frozen
+
     @staticmethod
     def from_rows(rows: List[List[Dict[str, Any]]]) -> List[List[Dict[str, Any]]]:
         """Собрать из готовых рядов (список списков кнопок)."""
@@ -42,7 +124,7 @@ class Keyboard:
 
 
 class MultiSelectKeyboard:
-    """Helper для мультивыбора через inline-кнопки с чекбоксами."""
+    """Helper для мультивыбора через inline-кнопки с чекбоксами. С page_size — постранично: рисуется только текущая страница, выбор общий для всех страниц."""
 
     def __init__(
         self,
@@ -61,11 +143,29 @@ class MultiSelectKeyboard:
         clear_text: str = "❌ Снять всё",
         done_text: str = "➡️ Продолжить",
         cancel_text: Optional[str] = "🔙 Назад",
+        page_size: Optional[int] = None,
+        page: int = 0,
+        query: Optional[str] = None,
+        page_cmd: str = "/ms_page",
+        prev_text: str = "◀️",
+        next_text: str = "▶️",
+        page_text: str = "{page} / {pages}",
     ) -> None:
+        """page_size — элементов на странице (None — все на одной, как раньше). page — текущая страница с нуля. query — поиск: остаются элементы, у которых текст или одно из слов начинается с query (без учёта регистра). page_cmd / prev_text / next_text / page_text — кнопки листания."""
+        if page_size is not None and page_size < 1:
+            raise ValueError("page_size must be >= 1")
         self._items: List[Dict[str, str]] = [dict(i) for i in items]
-        self._selected: Set[str] = set(selected or [])
         self._id_key = id_key
         self._text_key = text_key
+        # id и текст считаются один раз: build() и toggle() по ним не пересчитывают весь список
+        self._ids: List[str] = [str(item.get(id_key, "")) for item in self._items]
+        self._texts: List[str] = [
+            str(item.get(text_key, item_id)) for item, item_id in zip(self._items, self._ids)
+        ]
+        self._id_set: Set[str] = set(self._ids)
+        self._selected: Set[str] = set()
+        self._selected_known = 0  # сколько выбранных есть среди items — для O(1) "выбрано всё"
+        self.set_selected(selected or [])
         self._toggle_cmd = toggle_cmd
         self._all_cmd = all_cmd
         self._done_cmd = done_cmd
@@ -76,57 +176,154 @@ class MultiSelectKeyboard:
         self._clear_text = clear_text
         self._done_text = done_text
         self._cancel_text = cancel_text
+        self._page_size = page_size
+        self._page = 0
+        self._page_cmd = page_cmd
+        self._prev_text = prev_text
+        self._next_text = next_text
+        self._page_text = page_text
+        self._search_index: Optional[List[Tuple[str, int]]] = None
+        self._query: Optional[str] = None
+        self._matches: Optional[List[int]] = None
+        self.set_query(query)
+        self.set_page(page)
 
     def selected(self) -> List[str]:
         """Текущий список выбранных id."""
         return list(self._selected)
 
+    @property
+    def selected_count(self) -> int:
+        """Сколько элементов из items выбрано."""
+        return self._selected_known
+
+    @property
+    def all_selected(self) -> bool:
+        """Выбраны все элементы. O(1) — по счётчику, без обхода списка."""
+        return bool(self._id_set) and self._selected_known == len(self._id_set)
+
     def set_selected(self, selected: Sequence[str]) -> "MultiSelectKeyboard":
         """Полностью заменить выбранные id."""
         self._selected = set(selected)
+        self._selected_known = len(self._selected & self._id_set)
         return self
 
     def toggle(self, item_id: str) -> "MultiSelectKeyboard":
         """Переключить состояние одного элемента."""
+        known = item_id in self._id_set
         if item_id in self._selected:
             self._selected.remove(item_id)
+            self._selected_known -= known
         else:
             self._selected.add(item_id)
+            self._selected_known += known
         return self
 
     def select_all(self) -> "MultiSelectKeyboard":
         """Выбрать все элементы."""
-        self._selected = {str(item.get(self._id_key, "")) for item in self._items if item.get(self._id_key)}
+        self._selected = {item_id for item_id in self._ids if item_id}
+        self._selected_known = len(self._selected)
         return self
 
     def clear_all(self) -> "MultiSelectKeyboard":
         """Снять выделение со всех элементов."""
         self._selected.clear()
+        self._selected_known = 0
+        return self
+
+    @property
+    def page(self) -> int:
+        """Текущая страница (с нуля), уже в пределах pages."""
+        return min(self._page, self.pages - 1)
+
+    @property
+    def pages(self) -> int:
+        """Число страниц с учётом поиска; минимум 1."""
+        total = self._visible_count()
+        if not self._page_size or total == 0:
+            return 1
+        return (total + self._page_size - 1) // self._page_size
+
+    def set_page(self, page: int) -> "MultiSelectKeyboard":
+        """Перейти на страницу (номер из payload кнопки листания). Выход за границы — ближайшая существующая."""
+        self._page = max(int(page), 0)
+        return self
+
+    def set_query(self, query: Optional[str]) -> "MultiSelectKeyboard":
+        """Поиск по началу текста или слова. Пустой / None — все элементы. Новый query — снова первая страница."""
+        query = " ".join((query or "").lower().split()) or None
+        if query != self._query:
+            self._query = query
+            self._matches = self._search(query) if query else None
+            self._page = 0
         return self
 
+    def _search(self, query: str) -> List[int]:
+        """Индексы подходящих элементов в исходном порядке. Индекс слов строится один раз, дальше — бинарный поиск по префиксу."""
+        if self._search_index is None:
+            keys = []
+            for idx, text in enumerate(self._texts):
+                words = text.lower().split()
+                # ключ — хвост текста с каждого слова: "ром" и "клиент 4" найдут "ООО Клиент 42"
+                for j in range(len(words)):
+                    keys.append((" ".join(words[j:]), idx))
+            keys.sort()
+            self._search_index = keys
+        index = self._search_index
+        found = set()
+        pos = bisect.bisect_left(index, (query, -1))
+        while pos < len(index) and index[pos][0].startswith(query):
+            found.add(index[pos][1])
+            pos += 1
+        return sorted(found)
+
+    def _visible_count(self) -> int:
+        return len(self._matches) if self._matches is not None else len(self._items)
+
+    def _visible_page(self) -> Iterable[int]:
+        """Индексы элементов текущей страницы — без копирования всего списка."""
+        total = self._visible_count()
+        if self._page_size:
+            start = self.page * self._page_size
+            end = min(start + self._page_size, total)
+        else:
+            start, end = 0, total
+        if self._matches is not None:
+            return self._matches[start:end]
+        return range(start, end)
+
+    def _page_button(self, text: str, page: int) -> Dict[str, Any]:
+        return Keyboard.button(text, callback_data={"cmd": self._page_cmd, "page": page})
+
     def build(self) -> List[List[Dict[str, Any]]]:
-        """Собрать inline-клавиатуру для мультивыбора."""
+        """Собрать inline-клавиатуру для мультивыбора: только видимая страница + листание + служебные кнопки."""
         kb = Keyboard()
-        item_ids = [str(item.get(self._id_key, "")) for item in self._items]
-
-        for item in self._items:
-            item_id = str(item.get(self._id_key, ""))
-            item_text = str(item.get(self._text_key, item_id))
+        paged = self._page_size is not None
+        page = self.page
+        for idx in self._visible_page():
+            item_id = self._ids[idx]
             icon = self._selected_icon if item_id in self._selected else self._unselected_icon
-            kb.row(
-                Keyboard.button(
-                    f"{icon} {item_text}",
-                    callback_data={"cmd": self._toggle_cmd, "id": item_id},
-                )
-            )
-
-        has_items = bool(item_ids)
-        all_selected = has_items and all(item_id in self._selected for item_id in item_ids)
+            data: Dict[str, Any] = {"cmd": self._toggle_cmd, "id": item_id}
+            if paged:
+                # обработчик перерисует ту же страницу, не храня её у себя
+                data["page"] = page
+            kb.row(Keyboard.button(f"{icon} {self._texts[idx]}", callback_data=data))
+
+        pages = self.pages
+        if pages > 1:
+            nav = []
+            if page > 0:
+                nav.append(self._page_button(self._prev_text, page - 1))
+            nav.append(self._page_button(self._page_text.format(page=page + 1, pages=pages), page))
+            if page < pages - 1:
+                nav.append(self._page_button(self._next_text, page + 1))
+            kb.row(*nav)
+
+        all_data: Dict[str, Any] = {"cmd": self._all_cmd}
+        if paged:
+            all_data["page"] = page
         kb.row(
-            Keyboard.button(
-                self._clear_text if all_selected else self._all_text,
-                callback_data={"cmd": self._all_cmd},
-            )
+            Keyboard.button(self._clear_text if self.all_selected else self._all_text, callback_data=all_data)
         )
         kb.row(Keyboard.button(self._done_text, callback_data={"cmd": self._done_cmd}))
         if self._cancel_text and self._cancel_cmd:
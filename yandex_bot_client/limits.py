@@ -0,0 +1,122 @@
+"""Ограничения одного хендлера: сколько его вызовов идёт одновременно (max_concurrency) и сколько может длиться вызов (timeout). Медленный хендлер не занимает все воркеры и не держит их дольше срока."""
+
+import asyncio
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, List, Optional, Union
+
+from .executors import offloaded_calls
+
+# str — ответить этим текстом; функция — async (event) -> Any или обычная
+OnTimeout = Union[str, Callable[[Any], Any], None]
+
+
+class HandlerTimeout(Exception):
+    """Хендлер не уложился в timeout и отменён. Диспетчер логирует и выполняет on_timeout."""
+
+    def __init__(self, limits: "HandlerLimits", func: Callable) -> None:
+        super().__init__(f"{getattr(func, '__name__', func)!s} timed out after {limits.timeout} s")
+        self.limits = limits
+        self.func = func
+
+
+class HandlerLimits:
+    """max_concurrency — не больше стольких вызовов хендлера сразу, остальные ждут слота. timeout — секунд на вызов вместе с ожиданием слота; дольше — вызов отменяется, поднимается HandlerTimeout. Семафор у каждого хендлера свой — общей блокировки нет. def-хендлер в пуле по timeout не прерывается: его слот занят, пока поток/процесс не закончит. В run_multiprocess лимит действует в каждом процессе отдельно."""
+
+    __slots__ = ("max_concurrency", "timeout", "on_timeout", "_sem")
+
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+        on_timeout: OnTimeout = None,
+    ) -> None:
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError("max_concurrency must be >= 1")
+        if timeout is not None and timeout <= 0:
+            raise ValueError("timeout must be > 0")
+        if on_timeout is not None and timeout is None:
+            raise ValueError("on_timeout requires timeout")
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.on_timeout = on_timeout
+        self._sem: Optional[asyncio.Semaphore] = None
+
+    @classmethod
+    def from_options(
+        cls,
+        max_concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+        on_timeout: OnTimeout = None,
+    ) -> Optional["HandlerLimits"]:
+        """None, если ограничений нет — хендлер вызывается напрямую."""
+        if max_concurrency is None and timeout is None and on_timeout is None:
+            return None
+        return cls(max_concurrency, timeout, on_timeout)
+
+    @property
+    def active(self) -> int:
+        """Сколько вызовов сейчас занимают слоты (при max_concurrency)."""
+        if self._sem is None:
+            return 0
+        return self.max_concurrency - self._sem._value
+
+    async def _run(self, func: Callable[..., Awaitable[Any]], event: Any, data: dict) -> Any:
+        if self.max_concurrency is None:
+            return await func(event, **data)
+        if self._sem is None:
+            # создаётся в работающем loop — при первом вызове
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+        await self._sem.acquire()
+        calls: List[Future] = []
+        token = offloaded_calls.set(calls)
+        try:
+            return await func(event, **data)
+        finally:
+            offloaded_calls.reset(token)
+            running = [f for f in calls if not f.done()]
+            if running:
+                # отменённый по timeout def-хендлер дорабатывает в потоке/процессе — слот занят, пока он не закончит
+                self._release_after(running)
+            else:
+                self._sem.release()
+
+    def _release_after(self, futures: List[Future]) -> None:
+        loop = asyncio.get_running_loop()
+        left = len(futures)
+
+        def one_done() -> None:
+            nonlocal left
+            left -= 1
+            if left == 0:
+                self._sem.release()
+
+        def on_done(_: Future) -> None:
+            try:
+                loop.call_soon_threadsafe(one_done)
+            except RuntimeError:
+                # loop уже закрыт — освобождать некому
+                pass
+
+        for f in futures:
+            f.add_done_callback(on_done)
+
+    def wrap(self, func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        """func(event, **data) под этими ограничениями."""
+
+        async def limited(event: Any, **data: Any) -> Any:
+            if self.timeout is None:
+                return await self._run(func, event, data)
+            # не wait_for: свой asyncio.TimeoutError хендлера (например, от aiohttp) — обычная ошибка, не таймаут
+            task = asyncio.ensure_future(self._run(func, event, data))
+            try:
+                done, _ = await asyncio.wait((task,), timeout=self.timeout)
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+            if not done:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                raise HandlerTimeout(self, func)
+            return task.result()
+
+        return limited
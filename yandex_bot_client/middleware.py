@@ -1,6 +1,7 @@
-"""Middleware — цепочка до хендлера. async (handler, event, data) -> await handler(event, data). event — Message или CallbackQuery, data можно дополнять. Регистрация: bot.middleware(mw), вызов по порядку."""
+"""Middleware — цепочка до хендлера. async (handler, event, data) -> await handler(event, data). event — Message или CallbackQuery, data можно дополнять. Регистрация: bot.middleware(mw) — вокруг каждого хендлера, bot.outer_middleware(mw) — один раз на update. Вызов по порядку."""
 
-from typing import Any, Awaitable, Callable, Dict, Union
+import functools
+from typing import Any, Awaitable, Callable, Dict, Sequence, Union
 
 from .types import CallbackQuery, Message
 
@@ -14,3 +15,20 @@ Middleware = Callable[
 def noop_middleware(handler: Handler, event: Union[Message, CallbackQuery], data: Dict[str, Any]) -> Awaitable[Any]:
     """Просто прокидывает в следующий в цепочке."""
     return handler(event, data)
+
+
+async def _call_handler(func: Handler, event: Union[Message, CallbackQuery], data: Dict[str, Any]) -> Any:
+    return await func(event, **data)
+
+
+def compile_chain(middlewares: Sequence[Middleware], final: Handler) -> Handler:
+    """Цепочка middlewares вокруг final (event, data), собранная один раз: partial на каждое звено, на update замыкания не создаются."""
+    handler = final
+    for mw in reversed(middlewares):
+        handler = functools.partial(mw, handler)
+    return handler
+
+
+def compile_handler(middlewares: Sequence[Middleware], func: Handler) -> Handler:
+    """Готовый вызов хендлера: (event, data) → middlewares → func(event, **data)."""
+    return compile_chain(middlewares, functools.partial(_call_handler, func))
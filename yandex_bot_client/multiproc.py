@@ -0,0 +1,257 @@
+"""Несколько процессов: родитель опрашивает API и раздаёт updates по login в N процессов-воркеров. У каждого воркера свой Bot из factory (роутеры, FSM, сессия) — тяжёлые хендлеры одного процесса не тормозят остальные."""
+
+import asyncio
+import multiprocessing
+import threading
+import time
+import zlib
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+
+from .dispatcher import ShardedDispatcher, update_login
+
+if TYPE_CHECKING:
+    from .client import Bot
+
+# Маркер остановки потока чтения done; update_id таким быть не может.
+_STOP = "__stop__"
+
+# Как часто проверять, живы ли воркеры.
+_WATCH_INTERVAL = 0.5
+# Больше стольких падений одного воркера за _RESTART_WINDOW секунд — не перезапускать, а остановить бота.
+_MAX_RESTARTS = 3
+_RESTART_WINDOW = 60.0
+
+
+def _worker_main(factory: Callable[[], "Bot"], inbox: Any, done: Any) -> None:
+    """Точка входа процесса-воркера: свой Bot из factory и свой event loop."""
+    bot = factory()
+    try:
+        asyncio.run(_serve(bot, inbox, done))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _serve(bot: "Bot", inbox: Any, done: Any) -> None:
+    """Забирает updates из inbox до None, гонит через шарды воркера; update_id обработанных — в done."""
+    bot._open_session()
+    bot._handler_index()
+    await bot._storage.open()
+    bot._running = True
+    loop = asyncio.get_running_loop()
+    dispatcher = ShardedDispatcher(
+        bot._process_update,
+        bot._workers,
+        bot._log,
+        shed_after=bot._shed_after,
+        on_shed=bot._shed_update,
+        on_done=lambda u: done.put(u.get("update_id")),
+    )
+    bot._dispatcher = dispatcher
+    dispatcher.start()
+    try:
+        while True:
+            update = await loop.run_in_executor(None, inbox.get)
+            if update is None:
+                break
+            dispatcher.submit(update)
+    finally:
+        await bot._stop_dispatcher()
+        bot._executors.shutdown()
+        await bot._storage.close()
+        await bot._close_session()
+        bot._running = False
+
+
+class ProcessDispatcher:
+    """Тот же интерфейс, что у ShardedDispatcher (put/submit/free/pending/stop), только шард — процесс. crc32(login) % processes — пользователь всегда в одном процессе: порядок и FSM не разъезжаются. Упавший воркер перезапускается, его необработанные updates уходят новому (возможен повтор); падает чаще _MAX_RESTARTS раз за _RESTART_WINDOW — on_fail."""
+
+    def __init__(
+        self,
+        factory: Callable[[], "Bot"],
+        processes: int,
+        log: Any,
+        *,
+        max_pending: Optional[int] = None,
+        on_done: Optional[Callable[[Dict], None]] = None,
+        on_fail: Optional[Callable[[], None]] = None,
+    ) -> None:
+        if processes < 1:
+            raise ValueError("processes must be >= 1")
+        if max_pending is not None and max_pending < 1:
+            raise ValueError("max_pending must be >= 1")
+        # spawn: fork посреди работающего event loop и открытых сокетов ненадёжен
+        self._ctx = multiprocessing.get_context("spawn")
+        self._factory = factory
+        self._log = log
+        self._max_pending = max_pending
+        self._on_done = on_done
+        self._on_fail = on_fail
+        self._done = self._ctx.Queue()
+        self._inboxes = [self._ctx.Queue() for _ in range(processes)]
+        self._procs = [self._new_process(i) for i in range(processes)]
+        # отданные и не обработанные: по шарду update_id → update, в порядке отдачи — для повтора после падения
+        self._unfinished: List[Dict[Any, Dict]] = [{} for _ in range(processes)]
+        self._shard_of_uid: Dict[Any, int] = {}
+        self._crashes: List[List[float]] = [[] for _ in range(processes)]
+        self._failed: Optional[str] = None
+        self._stopping = False
+        self._watcher: Optional[asyncio.Task] = None
+        self._reader: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._inflight = 0
+        self._space = asyncio.Event()
+        self._space.set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def _new_process(self, shard: int) -> Any:
+        return self._ctx.Process(
+            target=_worker_main,
+            args=(self._factory, self._inboxes[shard], self._done),
+            name=f"yandex-bot-worker-{shard}",
+            # не daemon: daemon-процессу нельзя заводить свои, а executor="process" в воркере поднимает пул процессов;
+            # не успевших остановиться добивает stop()
+            daemon=False,
+        )
+
+    @property
+    def pending(self) -> int:
+        """Сколько updates отдано воркерам и ещё не обработано."""
+        return self._inflight
+
+    @property
+    def free(self) -> Optional[int]:
+        if self._max_pending is None:
+            return None
+        return max(self._max_pending - self._inflight, 0)
+
+    def shard_of(self, login: str) -> int:
+        return zlib.crc32(login.encode("utf-8")) % len(self._inboxes)
+
+    def submit(self, update: Dict) -> None:
+        if self._failed is not None:
+            raise RuntimeError(self._failed)
+        shard = self.shard_of(update_login(update))
+        uid = update.get("update_id")
+        self._unfinished[shard][uid] = update
+        self._shard_of_uid[uid] = shard
+        self._inflight += 1
+        self._idle.clear()
+        if self._max_pending is not None and self._inflight >= self._max_pending:
+            self._space.clear()
+        # mp.Queue.put не блокирует: сериализация и запись в pipe — в фоновом потоке очереди
+        self._inboxes[shard].put(update)
+
+    async def put(self, update: Dict) -> None:
+        while self._max_pending is not None and self._inflight >= self._max_pending:
+            await self._space.wait()
+        self.submit(update)
+
+    def _release(self, uid: Any) -> bool:
+        shard = self._shard_of_uid.pop(uid, None)
+        if shard is None:
+            # отметка от упавшего воркера о update, уже отданном заново, или о забытом после отказа
+            return False
+        self._unfinished[shard].pop(uid, None)
+        self._inflight -= 1
+        if self._max_pending is None or self._inflight < self._max_pending:
+            self._space.set()
+        if self._inflight <= 0:
+            self._idle.set()
+        return True
+
+    def _finish(self, update_id: Any) -> None:
+        if self._release(update_id) and self._on_done is not None:
+            self._on_done({"update_id": update_id})
+
+    def _read_done(self) -> None:
+        """Поток: читает отметки воркеров и передаёт их в event loop."""
+        while True:
+            item = self._done.get()
+            if item == _STOP:
+                break
+            self._loop.call_soon_threadsafe(self._finish, item)
+
+    async def _watch(self) -> None:
+        """Следит за воркерами: упавший перезапускается с его необработанными updates, слишком частые падения — отказ."""
+        while not self._stopping:
+            await asyncio.sleep(_WATCH_INTERVAL)
+            for shard, proc in enumerate(self._procs):
+                if self._stopping or self._failed is not None:
+                    return
+                if proc.exitcode is not None:
+                    self._worker_died(shard, proc.exitcode)
+
+    def _worker_died(self, shard: int, exitcode: int) -> None:
+        now = time.monotonic()
+        crashes = self._crashes[shard]
+        crashes[:] = [t for t in crashes if now - t < _RESTART_WINDOW] + [now]
+        lost = self._unfinished[shard]
+        if len(crashes) > _MAX_RESTARTS:
+            self._failed = f"worker {shard} failed {len(crashes)} times in {_RESTART_WINDOW:.0f} s (exit code {exitcode})"
+            self._log.error("workers: {} — останавливаюсь, {} updates не обработаны", self._failed, len(lost))
+            # без отметок в журнал: необработанные повторятся при следующем запуске
+            for uid in list(lost):
+                self._release(uid)
+            if self._on_fail is not None:
+                self._on_fail()
+            return
+        self._log.error("workers: воркер {} завершился с кодом {}, перезапуск ({} updates заново)", shard, exitcode, len(lost))
+        old = self._inboxes[shard]
+        # что лежит в старой очереди, уйдёт заново из lost — очередь бросаем, не дожидаясь её фонового потока
+        old.cancel_join_thread()
+        old.close()
+        inbox = self._inboxes[shard] = self._ctx.Queue()
+        proc = self._procs[shard] = self._new_process(shard)
+        proc.start()
+        for update in lost.values():
+            inbox.put(update)
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        for p in self._procs:
+            p.start()
+        self._reader = threading.Thread(target=self._read_done, name="yandex-bot-done", daemon=True)
+        self._reader.start()
+        self._watcher = asyncio.create_task(self._watch())
+
+    async def stop(self, timeout: Optional[float] = 10.0) -> None:
+        """Ждёт обработки отданных updates (до timeout), останавливает воркеров, не успевших — завершает принудительно."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            self._log.warning("workers: {} updates не обработаны к остановке", self.pending)
+        self._stopping = True
+        if self._watcher is not None:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
+        for inbox in self._inboxes:
+            inbox.put(None)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._join, timeout)
+        self._done.put(_STOP)
+        if self._reader is not None:
+            await loop.run_in_executor(None, self._reader.join)
+            self._reader = None
+
+    def _join(self, timeout: Optional[float]) -> None:
+        for p in self._procs:
+            p.join(timeout)
+            if p.is_alive():
+                p.terminate()
+                p.join()
+
+
+def start_process_dispatcher(bot: "Bot", factory: Callable[[], "Bot"], processes: int) -> ProcessDispatcher:
+    """Процессы-воркеры под настройки опрашивающего бота: предел приёма — его intake_size, отметки для журнала — в его журнал. Воркеры не поднимаются — бот останавливается."""
+    dispatcher = ProcessDispatcher(
+        factory,
+        processes,
+        bot._log,
+        max_pending=bot._intake_size,
+        on_done=bot._update_done if bot._journal is not None else None,
+        on_fail=bot.stop,
+    )
+    dispatcher.start()
+    return dispatcher
@@ -0,0 +1,221 @@
+"""Исходящая очередь: отправки идут через очередь с token bucket — общим и на login. Порядок сообщений одному login сохраняется, повторы и circuit breaker — из resilience."""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, Union
+
+from .resilience import CircuitBreaker, RetryPolicy, is_retryable
+
+
+class SendResult:
+    """Итог одного HTTP-запроса к API. status 0 — соединение не установилось (запрос точно не ушёл), -1 — ответа нет, но запрос мог дойти."""
+
+    __slots__ = ("status", "message_id", "retry_after", "error")
+
+    def __init__(
+        self,
+        status: int,
+        message_id: Optional[int] = None,
+        retry_after: Optional[float] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        self.status = status
+        self.message_id = message_id
+        self.retry_after = retry_after
+        self.error = error
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше burst про запас. acquire() ждёт ровно столько, сколько не хватает."""
+
+    __slots__ = ("rate", "burst", "_tokens", "_stamp")
+
+    def __init__(self, rate: float, burst: float) -> None:
+        if rate <= 0:
+            raise ValueError("rate must be > 0")
+        if burst < 1:
+            raise ValueError("burst must be >= 1")
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = float(burst)
+        self._stamp = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def is_full(self, now: float) -> bool:
+        return self._tokens + (now - self._stamp) * self.rate >= self.burst
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# Сколько login-bucket'ов держать, прежде чем выкинуть полные (простаивающие) — чтобы словарь не рос бесконечно.
+_LOGIN_BUCKETS_SWEEP = 10000
+
+# payload — dict или уже сериализованное тело (bytes), см. Bot.broadcast
+_Item = Tuple[Union[Dict[str, Any], bytes], str, bool, "asyncio.Future[SendResult]"]
+
+
+class Outbox:
+    """Очередь на login + очередь готовых login'ов. Один login в работе максимум у одного отправителя — так сохраняется порядок; разные login'ы шлются параллельно (workers отправителей)."""
+
+    def __init__(
+        self,
+        request: Callable[[Union[Dict[str, Any], bytes]], Awaitable[SendResult]],
+        log: Any,
+        *,
+        rate: Optional[float] = None,
+        burst: Optional[float] = None,
+        login_rate: Optional[float] = None,
+        login_burst: Optional[float] = None,
+        workers: int = 64,
+        policy: Optional[RetryPolicy] = None,
+        breaker: Optional[CircuitBreaker] = None,
+    ) -> None:
+        if workers < 1:
+            raise ValueError("workers must be >= 1")
+        self._request = request
+        self._log = log
+        self._global = TokenBucket(rate, burst or max(rate, 1.0)) if rate else None
+        self._login_rate = login_rate
+        self._login_burst = login_burst or (max(login_rate, 1.0) if login_rate else 1.0)
+        self._login_buckets: Dict[str, TokenBucket] = {}
+        self._workers_count = workers
+        self._policy = policy or RetryPolicy()
+        self._breaker = breaker
+        self._queues: Dict[str, Deque[_Item]] = {}
+        self._ready: "asyncio.Queue[str]" = asyncio.Queue()
+        self._workers: List[asyncio.Task] = []
+        self._paused_until = 0.0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @property
+    def pending(self) -> int:
+        """Сколько сообщений ждёт отправки (включая отправляемые)."""
+        return sum(len(q) for q in self._queues.values())
+
+    def enqueue(
+        self, login: str, payload: Union[Dict[str, Any], bytes], op: str, *, idempotent: bool = False
+    ) -> "asyncio.Future[SendResult]":
+        """Ставит отправку в очередь login. Future — SendResult последней попытки (status 200 — отправлено). idempotent — запрос можно повторить и без ответа сервера (редактирование)."""
+        fut: "asyncio.Future[SendResult]" = asyncio.get_running_loop().create_future()
+        q = self._queues.get(login)
+        if q is None:
+            q = deque()
+            self._queues[login] = q
+            self._ready.put_nowait(login)
+        q.append((payload, op, idempotent, fut))
+        self._idle.clear()
+        return fut
+
+    def _login_bucket(self, login: str) -> Optional[TokenBucket]:
+        if not self._login_rate:
+            return None
+        bucket = self._login_buckets.get(login)
+        if bucket is None:
+            if len(self._login_buckets) >= _LOGIN_BUCKETS_SWEEP:
+                now = time.monotonic()
+                # полный bucket ничем не отличается от нового — его можно выбросить
+                self._login_buckets = {
+                    k: b for k, b in self._login_buckets.items() if not b.is_full(now)
+                }
+            bucket = TokenBucket(self._login_rate, self._login_burst)
+            self._login_buckets[login] = bucket
+        return bucket
+
+    async def _wait_pause(self) -> None:
+        """API ответил 429 — все отправители ждут до Retry-After."""
+        while True:
+            delay = self._paused_until - time.monotonic()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    async def _send(
+        self, login: str, payload: Union[Dict[str, Any], bytes], op: str, idempotent: bool
+    ) -> SendResult:
+        bucket = self._login_bucket(login)
+        breaker = self._breaker
+        attempts = self._policy.attempts
+        for attempt in range(attempts):
+            await self._wait_pause()
+            if self._global is not None:
+                await self._global.acquire()
+            if bucket is not None:
+                await bucket.acquire()
+            # breaker — сразу перед запросом: между allow() и record() нет других ожиданий
+            if breaker is not None and not breaker.allow():
+                self._log.warning("{}: API недоступен (circuit open), не отправлено", op)
+                return SendResult(0, error="circuit open")
+            try:
+                result = await self._request(payload)
+            except BaseException:
+                if breaker is not None:
+                    breaker.release()
+                raise
+            if breaker is not None:
+                breaker.record(result.status)
+            if result.status == 200:
+                return result
+            if not is_retryable(result.status, idempotent=idempotent) or attempt + 1 >= attempts:
+                self._log.error("{} {}: {}", op, result.status, result.error)
+                return result
+            delay = self._policy.delay(attempt, result.retry_after)
+            if result.status == 429:
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self._log.warning("{} {}: повтор через {:.1f} с", op, result.status, delay)
+            await asyncio.sleep(delay)
+        return result
+
+    async def _worker(self) -> None:
+        while True:
+            login = await self._ready.get()
+            q = self._queues[login]
+            payload, op, idempotent, fut = q[0]
+            try:
+                result = await self._send(login, payload, op, idempotent)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._log.exception("{}: {}", op, e)
+                result = SendResult(-1, error=repr(e))
+            q.popleft()
+            if not fut.done():
+                fut.set_result(result)
+            if q:
+                # в конец очереди готовых — другие login'ы не ждут, пока этот выговорится
+                self._ready.put_nowait(login)
+            else:
+                del self._queues[login]
+                if not self._queues:
+                    self._idle.set()
+
+    def start(self) -> None:
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self._workers_count)]
+
+    async def stop(self, timeout: Optional[float] = 10.0) -> None:
+        """Дожидается отправки очереди (до timeout); что не ушло — future получают SendResult со status 0."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            self._log.warning("outbox: {} сообщений не отправлено к остановке", self.pending)
+        for t in self._workers:
+            t.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for q in self._queues.values():
+            for _, _, _, fut in q:
+                if not fut.done():
+                    fut.set_result(SendResult(0, error="outbox stopped"))
+        self._queues.clear()
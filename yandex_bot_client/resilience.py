@@ -0,0 +1,108 @@
+"""Устойчивость вызовов Bot API: классификация ошибок, повторы с экспоненциальной паузой и jitter, circuit breaker. Общие для опроса, отправки и рассылок."""
+
+import random
+import time
+from typing import Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def is_retryable(status: int, *, idempotent: bool) -> bool:
+    """Можно ли повторить запрос. 0 — соединение не установилось, 429 и 5xx — сервер не выполнил. -1 — ответа нет, но запрос мог дойти: повторяем только идемпотентные (редактирование, getUpdates)."""
+    if status == 0 or status == 429 or status >= 500:
+        return True
+    return status == -1 and idempotent
+
+
+def is_failure(status: int) -> bool:
+    """Считается ли ответ сбоем API для breaker. 4xx и 429 — API жив, просто отказал."""
+    return status <= 0 or status >= 500
+
+
+class RetryPolicy:
+    """attempts попыток всего. Пауза перед повтором n — случайная от 0 до min(max_delay, base_delay * 2**n) (full jitter); Retry-After сервера — нижняя граница."""
+
+    __slots__ = ("attempts", "base_delay", "max_delay")
+
+    def __init__(self, attempts: int = 4, base_delay: float = 0.5, max_delay: float = 30.0) -> None:
+        if attempts < 1:
+            raise ValueError("attempts must be >= 1")
+        if base_delay < 0 or max_delay < 0:
+            raise ValueError("delays must be >= 0")
+        self.attempts = int(attempts)
+        self.base_delay = float(base_delay)
+        self.max_delay = float(max_delay)
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Пауза после неудачной попытки attempt (с нуля)."""
+        cap = min(self.max_delay, self.base_delay * (2 ** attempt))
+        pause = random.uniform(0, cap)
+        if retry_after is not None:
+            pause = max(pause, retry_after)
+        return pause
+
+
+class CircuitBreaker:
+    """threshold сбоев подряд — open: вызовы сразу отклоняются. Через recovery секунд — half_open: пропускается один пробный вызов; успех закрывает, сбой снова открывает."""
+
+    __slots__ = ("threshold", "recovery", "_state", "_failures", "_opened_at", "_probing")
+
+    def __init__(self, threshold: int = 5, recovery: float = 30.0) -> None:
+        if threshold < 1:
+            raise ValueError("threshold must be >= 1")
+        if recovery <= 0:
+            raise ValueError("recovery must be > 0")
+        self.threshold = int(threshold)
+        self.recovery = float(recovery)
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        """"closed", "open" или "half_open". Open, у которого вышло recovery, уже считается half_open."""
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.recovery:
+            return HALF_OPEN
+        return self._state
+
+    @property
+    def available(self) -> bool:
+        """API считается доступным: breaker не open."""
+        return self.state != OPEN
+
+    def retry_in(self) -> float:
+        """Сколько секунд до пробного вызова; 0 — можно звать сейчас."""
+        if self._state != OPEN:
+            return 0.0
+        return max(self._opened_at + self.recovery - time.monotonic(), 0.0)
+
+    def allow(self) -> bool:
+        """Пропустить ли вызов. В half_open пропускает ровно один пробный, остальные отклоняет до его итога."""
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == OPEN or self._probing:
+            return False
+        self._state = HALF_OPEN
+        self._probing = True
+        return True
+
+    def release(self) -> None:
+        """Пропущенный allow() вызов не состоялся (отмена, ошибка до запроса): итог не засчитывается, пробный вызов снова свободен."""
+        self._probing = False
+
+    def record(self, status: int) -> None:
+        """Итог вызова: сбой (is_failure) или успех."""
+        if is_failure(status):
+            self._probing = False
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.threshold:
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+        else:
+            self._probing = False
+            self._failures = 0
+            self._state = CLOSED
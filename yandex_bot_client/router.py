@@ -1,21 +1,80 @@
-"""Роутер — группа хендлеров, подключается к боту через include_router. Удобно разнести логику по модулям (меню, оплаты и т.д.)."""
+"""Роутер — группа хендлеров, подключается к боту через include_router. Удобно разнести логику по модулям (меню, оплаты и т.д.). Роутеры вкладываются друг в друга; у роутера могут быть свои middleware и guard — условие на всё поддерево."""
 
-from typing import Any, Callable, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from .commands import CommandPattern
+from .executors import check_executor
+from .filters import Filter
+from .handler_index import router_mark
+from .limits import HandlerLimits, OnTimeout
+from .middleware import Middleware
 
 
 def _default_callback_filter(update: Dict, payload: Dict) -> bool:
     return True
 
 
+def _update_guard(func: Callable[[Dict], bool]) -> Filter:
+    # guard-функция получает только update — и для сообщений, и для кнопок
+    return Filter(lambda update, payload=None: func(update))
+
+
 class Router:
-    """Куча обработчиков с тем же API, что у Bot. При include_router бот копирует их в себя — роутер на бота не ссылается."""
+    """Куча обработчиков с тем же API, что у Bot. name — для логов и repr. guard — Filter (F.text.startswith("/admin"), StatePrefix("order:"), StateFilter, ...) или функция (update) -> bool: не прошёл — ни один хендлер роутера и вложенных роутеров не рассматривается. Бот хранит дерево роутеров и при старте собирает его в индекс."""
 
-    def __init__(self) -> None:
-        pass
+    def __init__(
+        self,
+        name: Optional[str] = None,
+        *,
+        guard: Optional[Union[Filter, Callable[[Dict], bool]]] = None,
+    ) -> None:
+        self.name = name
+        self._guard: Optional[Filter] = (
+            guard if guard is None or isinstance(guard, Filter) else _update_guard(guard)
+        )
         self._handlers: List[Dict[str, Any]] = []
         self._button_handlers: List[Dict[str, Any]] = []
         self._callback_handlers: List[Dict[str, Any]] = []
         self._default_handlers: List[Dict[str, Any]] = []
+        self._middlewares: List[Middleware] = []
+        self._routers: List["Router"] = []
+        # сколько своих хендлеров было при include_router — туда и встаёт роутер
+        self._router_marks: List[Tuple[int, ...]] = []
+        self._parent: Optional["Router"] = None
+        # растёт при любом изменении поддерева — по нему бот видит, что индекс устарел
+        self._changes = 0
+
+    def __repr__(self) -> str:
+        return f"Router({self.name!r})" if self.name else "Router()"
+
+    def _touch(self) -> None:
+        node: Optional[Router] = self
+        while node is not None:
+            node._changes += 1
+            node = node._parent
+
+    def include_router(self, router: "Router") -> "Router":
+        """Вкладывает роутер: его хендлеры идут после хендлеров этого роутера, зарегистрированных до вызова, и перед зарегистрированными позже; под его guard и middleware. Роутер вкладывается только в одного родителя."""
+        if not isinstance(router, Router):
+            raise ValueError("include_router expects a Router")
+        if router._parent is not None:
+            raise ValueError(f"{router!r} is already included into {router._parent!r}")
+        node: Optional[Router] = self
+        while node is not None:
+            if node is router:
+                raise ValueError(f"{router!r} can't be included into itself")
+            node = node._parent
+        router._parent = self
+        self._routers.append(router)
+        self._router_marks.append(router_mark(self))
+        self._touch()
+        return self
+
+    def middleware(self, mw: Middleware) -> Middleware:
+        """Middleware только для хендлеров этого роутера и вложенных. Вызывается после middleware бота и родительских роутеров."""
+        self._middlewares.append(mw)
+        self._touch()
+        return mw
 
     def message_handler(
         self,
@@ -23,16 +82,59 @@ class Router:
         *,
         filters: Optional[Callable[[Dict], bool]] = None,
         state: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+        on_timeout: OnTimeout = None,
+        executor: Optional[str] = None,
     ) -> Callable[[Callable], Callable]:
-        """Как Bot.message_handler: text, filters, state."""
+        """Как Bot.message_handler: text, filters, state, max_concurrency, timeout, on_timeout, executor."""
+
+        limits = HandlerLimits.from_options(max_concurrency, timeout, on_timeout)
 
         def decorator(func: Callable) -> Callable:
+            check_executor(func, executor)
             self._handlers.append({
                 "text": text,
                 "filter": filters,
                 "state": state,
                 "func": func,
+                "executor": executor,
+                "limits": limits,
             })
+            self._touch()
+            return func
+
+        return decorator
+
+    def command_handler(
+        self,
+        pattern: str,
+        *,
+        aliases: Sequence[str] = (),
+        ignore_case: bool = False,
+        filters: Optional[Callable[[Dict], bool]] = None,
+        state: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+        on_timeout: OnTimeout = None,
+        executor: Optional[str] = None,
+    ) -> Callable[[Callable], Callable]:
+        """Как Bot.command_handler: "/order <int:id>", aliases, ignore_case, filters, state, ограничения, executor."""
+        command = CommandPattern(pattern, aliases=aliases, ignore_case=ignore_case)
+        limits = HandlerLimits.from_options(max_concurrency, timeout, on_timeout)
+
+        def decorator(func: Callable) -> Callable:
+            check_executor(func, executor)
+            self._handlers.append({
+                "text": None,
+                "command": command,
+                "filter": filters,
+                "state": state,
+                "func": func,
+                "executor": executor,
+                "limits": limits,
+            })
+            self._touch()
             return func
 
         return decorator
@@ -42,15 +144,25 @@ class Router:
         action: str,
         *,
         state: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+        on_timeout: OnTimeout = None,
+        executor: Optional[str] = None,
     ) -> Callable[[Callable], Callable]:
-        """Как Bot.button_handler: action без слэша, опционально state."""
+        """Как Bot.button_handler: action без слэша, опционально state, ограничения и executor."""
+
+        limits = HandlerLimits.from_options(max_concurrency, timeout, on_timeout)
 
         def decorator(func: Callable) -> Callable:
+            check_executor(func, executor)
             self._button_handlers.append({
                 "action": action,
                 "state": state,
                 "func": func,
+                "executor": executor,
+                "limits": limits,
             })
+            self._touch()
             return func
 
         return decorator
@@ -60,14 +172,24 @@ class Router:
         func: Optional[Callable] = None,
         *,
         filters: Optional[Callable[[Dict, Dict], bool]] = None,
+        max_concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+        on_timeout: OnTimeout = None,
+        executor: Optional[str] = None,
     ) -> Callable[[Callable], Callable]:
-        """Как Bot.callback_handler: кнопки без cmd или с произвольным payload. filters — (update, payload) -> bool."""
+        """Как Bot.callback_handler: кнопки без cmd или с произвольным payload. filters — (update, payload) -> bool. Ограничения и executor — как у Bot.message_handler."""
+
+        limits = HandlerLimits.from_options(max_concurrency, timeout, on_timeout)
 
         def decorator(f: Callable) -> Callable:
+            check_executor(f, executor)
             self._callback_handlers.append({
                 "filter": filters or _default_callback_filter,
                 "func": f,
+                "executor": executor,
+                "limits": limits,
             })
+            self._touch()
             return f
 
         if func is not None:
@@ -78,21 +200,18 @@ class Router:
         self,
         *,
         state: Optional[str] = None,
+        executor: Optional[str] = None,
     ) -> Callable[[Callable], Callable]:
-        """Как Bot.default_handler: вызывается, когда ни один message_handler не подошёл."""
+        """Как Bot.default_handler: вызывается, когда ни один message_handler не подошёл. executor — как у Bot.message_handler."""
 
         def decorator(func: Callable) -> Callable:
+            check_executor(func, executor)
             self._default_handlers.append({
                 "state": state,
                 "func": func,
+                "executor": executor,
             })
+            self._touch()
             return func
 
         return decorator
-
-    def _merge_into(self, bot: Any) -> None:
-        """Копирует все хендлеры роутера в бота (вызывает include_router)."""
-        bot._handlers.extend(self._handlers)
-        bot._button_handlers.extend(self._button_handlers)
-        bot._callback_handlers.extend(self._callback_handlers)
-        bot._default_handlers.extend(self._default_handlers)
@@ -0,0 +1,585 @@
+"""Хранилище FSM-состояния и данных пользователя (get_state/set_state, FSMContext, Bot.state). По умолчанию — память; SQLiteStorage переживает перезапуск: чтение из горячего кеша, запись — пачками в фоне."""
+
+import asyncio
+import sqlite3
+from abc import ABC, abstractmethod
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from loguru import logger
+
+from .codec import JsonCodec, StdlibCodec
+
+# (FSM-состояние, данные Bot.state) одного пользователя
+StateRecord = Tuple[Optional[str], Dict[str, Any]]
+
+# on_evict(login, state, data) — пользователь вытеснен из памяти
+OnEvict = Callable[[str, Optional[str], Dict[str, Any]], Any]
+
+
+class _Recency:
+    """Logins в порядке последнего обращения (OrderedDict, давний — первым) со временем обращения. touch — O(1) и сразу снимает с головы лишних сверх max_entries и простоявших дольше idle_ttl: каждый login снимается не больше раза на вставку, в сумме O(1) на обращение. Закреплённые pin() (их update ещё обрабатывается) не снимаются — уходят в хвост как только что тронутые; пока они есть, учтённых может быть больше max_entries."""
+
+    __slots__ = ("max_entries", "idle_ttl", "_order", "_next_expiry", "_pinned")
+
+    def __init__(self, max_entries: Optional[int], idle_ttl: Optional[float]) -> None:
+        if max_entries is not None and max_entries < 1:
+            raise ValueError("max_entries must be >= 1")
+        if idle_ttl is not None and idle_ttl <= 0:
+            raise ValueError("idle_ttl must be > 0")
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self._order: "OrderedDict[str, float]" = OrderedDict()
+        # раньше этого момента никто не истекает; оценка снизу — голову могли обновить
+        self._next_expiry = float("inf")
+        # login → сколько update'ов его сейчас обрабатывается
+        self._pinned: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def __contains__(self, login: str) -> bool:
+        return login in self._order
+
+    def touch(self, login: str) -> Sequence[str]:
+        """Отмечает обращение; возвращает вытесняемых (сам login среди них не бывает)."""
+        order = self._order
+        now = time.monotonic()
+        if login in order:
+            order.move_to_end(login)
+        order[login] = now
+        if self.idle_ttl is not None and now + self.idle_ttl < self._next_expiry:
+            self._next_expiry = now + self.idle_ttl
+        if (self.max_entries is None or len(order) <= self.max_entries) and now < self._next_expiry:
+            return ()
+        return self.pop_due(now)
+
+    def refresh(self, login: str) -> None:
+        """touch, только если login уже учтён: чтение не заводит запись."""
+        order = self._order
+        if login in order:
+            order.move_to_end(login)
+            order[login] = time.monotonic()
+
+    def discard(self, login: str) -> None:
+        self._order.pop(login, None)
+
+    def pin(self, login: str) -> None:
+        self._pinned[login] = self._pinned.get(login, 0) + 1
+
+    def unpin(self, login: str) -> None:
+        left = self._pinned.get(login, 0) - 1
+        if left > 0:
+            self._pinned[login] = left
+        else:
+            self._pinned.pop(login, None)
+
+    def pop_due(self, now: Optional[float] = None) -> List[str]:
+        order = self._order
+        pinned = self._pinned
+        if now is None:
+            now = time.monotonic()
+        due: List[str] = []
+        kept: List[str] = []
+        if self.max_entries is not None:
+            while order and len(order) + len(kept) > self.max_entries:
+                login = order.popitem(last=False)[0]
+                (kept if login in pinned else due).append(login)
+        if self.idle_ttl is not None:
+            deadline = now - self.idle_ttl
+            self._next_expiry = float("inf")
+            expired = []
+            for login, seen in order.items():
+                if seen > deadline:
+                    self._next_expiry = seen + self.idle_ttl
+                    break
+                expired.append(login)
+            for login in expired:
+                del order[login]
+                (kept if login in pinned else due).append(login)
+        for login in kept:
+            order[login] = now
+        if kept and self.idle_ttl is not None:
+            self._next_expiry = min(self._next_expiry, now + self.idle_ttl)
+        return due
+
+
+def _recency(max_entries: Optional[int], idle_ttl: Optional[float]) -> Optional[_Recency]:
+    return _Recency(max_entries, idle_ttl) if max_entries is not None or idle_ttl is not None else None
+
+
+class BaseStorage(ABC):
+    """Контракт хранилища. get_state / set_state / data — горячий путь хендлеров: только память, без I/O и без await. open / prefetch / flush / close зовёт бот: при старте, перед обработкой update (если needs_prefetch) и при остановке."""
+
+    @abstractmethod
+    def get_state(self, login: str) -> Optional[str]:
+        """FSM-состояние пользователя или None."""
+
+    @abstractmethod
+    def set_state(self, login: str, state: Optional[str]) -> None:
+        """state=None — сброс."""
+
+    @abstractmethod
+    def data(self, login: str) -> Dict[str, Any]:
+        """Изменяемый dict данных пользователя; нет — создаётся пустой."""
+
+    @property
+    @abstractmethod
+    def size(self) -> int:
+        """Сколько пользователей сейчас в памяти."""
+
+    def expire(self) -> int:
+        """Вытесняет простоявших дольше idle_ttl; сколько вытеснено."""
+        return 0
+
+    def needs_prefetch(self, login: str) -> bool:
+        """True — перед update этого login бот сделает await prefetch(login)."""
+        return False
+
+    def pin(self, login: str) -> None:
+        """Update этого login обрабатывается: до unpin() его нельзя вытеснять — хендлер держит его dict и читает state. Вложенные pin считаются."""
+
+    def unpin(self, login: str) -> None:
+        """Парный к pin()."""
+
+    async def prefetch(self, login: str) -> None:
+        pass
+
+    async def open(self) -> None:
+        pass
+
+    async def flush(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryStorage(BaseStorage):
+    """По умолчанию: два dict в памяти процесса. Перезапуск всё стирает. max_entries / idle_ttl — не больше стольких пользователей и не дольше стольких секунд без обращения: лишние вытесняются (состояние и данные вместе), давно не писавшие — первыми. on_evict(login, state, data) — куда отдать вытесненное."""
+
+    __slots__ = ("_states", "_datas", "_recent", "_on_evict", "_log", "evicted")
+
+    def __init__(
+        self,
+        *,
+        max_entries: Optional[int] = None,
+        idle_ttl: Optional[float] = None,
+        on_evict: Optional[OnEvict] = None,
+        log: Any = None,
+    ) -> None:
+        self._states: Dict[str, str] = {}
+        self._datas: Dict[str, Dict[str, Any]] = {}
+        self._recent = _recency(max_entries, idle_ttl)
+        self._on_evict = on_evict
+        self._log = log if log is not None else logger
+        self.evicted = 0
+
+    @property
+    def size(self) -> int:
+        if self._recent is not None:
+            return len(self._recent)
+        return len(self._states.keys() | self._datas.keys())
+
+    def get_state(self, login: str) -> Optional[str]:
+        if self._recent is not None:
+            self._recent.refresh(login)
+        return self._states.get(login)
+
+    def set_state(self, login: str, state: Optional[str]) -> None:
+        if state is None:
+            self._states.pop(login, None)
+            if self._recent is not None and login not in self._datas:
+                self._recent.discard(login)
+            return
+        self._states[login] = state
+        if self._recent is not None:
+            due = self._recent.touch(login)
+            if due:
+                self._evict(due)
+
+    def data(self, login: str) -> Dict[str, Any]:
+        found = self._datas.get(login)
+        if found is None:
+            found = self._datas[login] = {}
+        if self._recent is not None:
+            due = self._recent.touch(login)
+            if due:
+                self._evict(due)
+        return found
+
+    def expire(self) -> int:
+        if self._recent is None:
+            return 0
+        due = self._recent.pop_due()
+        self._evict(due)
+        return len(due)
+
+    def pin(self, login: str) -> None:
+        if self._recent is not None:
+            self._recent.pin(login)
+
+    def unpin(self, login: str) -> None:
+        if self._recent is not None:
+            self._recent.unpin(login)
+
+    def _evict(self, logins: Sequence[str]) -> None:
+        for login in logins:
+            state = self._states.pop(login, None)
+            data = self._datas.pop(login, None) or {}
+            self.evicted += 1
+            if self._on_evict is not None:
+                try:
+                    self._on_evict(login, state, data)
+                except Exception as e:
+                    self._log.exception("storage on_evict: {}", e)
+
+
+class AsyncStorage(ABC):
+    """Внешнее хранилище с async I/O (SQLite, Redis, своя БД). Хендлеры его не зовут — оно стоит за CachedStorage: load — при первом update пользователя, save — пачкой изменённых записей."""
+
+    async def open(self) -> None:
+        pass
+
+    @abstractmethod
+    async def load(self, login: str) -> Optional[StateRecord]:
+        """Запись пользователя или None, если её нет."""
+
+    async def load_many(self, logins: List[str]) -> Dict[str, StateRecord]:
+        """Записи нескольких пользователей; отсутствующих в ответе нет. Переопредели, если backend умеет одним запросом."""
+        found = {}
+        for login in logins:
+            record = await self.load(login)
+            if record is not None:
+                found[login] = record
+        return found
+
+    @abstractmethod
+    async def save(self, records: Dict[str, StateRecord]) -> None:
+        """Записать пачку. Запись без состояния и с пустыми данными можно удалить."""
+
+    async def close(self) -> None:
+        pass
+
+
+class CachedStorage(BaseStorage):
+    """Горячий кеш перед AsyncStorage. Чтение — поиск в dict; запись — в dict и в множество изменённых, на диск/в сеть уходит пачкой раз в flush_interval и при close(). Пользователь подгружается из backend один раз — бот ждёт prefetch до хендлеров. data(login) помечает пользователя изменённым: dict меняют на месте. Запись чужому login без prefetch не затирает сохранённое: перед записью оно подгружается и дополняет значения из памяти. Вне update перед чтением — await storage.prefetch(login). max_entries / idle_ttl / on_evict — как у MemoryStorage; несохранённый пользователь покидает память только после записи, при следующем обращении он снова читается из backend."""
+
+    def __init__(
+        self,
+        backend: AsyncStorage,
+        *,
+        flush_interval: float = 1.0,
+        max_entries: Optional[int] = None,
+        idle_ttl: Optional[float] = None,
+        on_evict: Optional[OnEvict] = None,
+        log: Any = None,
+    ) -> None:
+        if flush_interval <= 0:
+            raise ValueError("flush_interval must be > 0")
+        self.backend = backend
+        self._flush_interval = flush_interval
+        self._log = log if log is not None else logger
+        self._states: Dict[str, str] = {}
+        self._datas: Dict[str, Dict[str, Any]] = {}
+        self._loaded: Set[str] = set()
+        # изменены, но из backend не читались — перед записью подгружаются и сливаются
+        self._partial: Set[str] = set()
+        self._dirty: Set[str] = set()
+        self._recent = _recency(max_entries, idle_ttl)
+        # вытеснены, но ещё не записаны — уходят из памяти после ближайшего flush
+        self._evicting: Set[str] = set()
+        self._on_evict = on_evict
+        self.evicted = 0
+        self._lock: Optional[asyncio.Lock] = None
+        self._flusher: Optional[asyncio.Task] = None
+
+    @property
+    def dirty(self) -> int:
+        """Сколько пользователей ждут записи."""
+        return len(self._dirty)
+
+    @property
+    def size(self) -> int:
+        # _loaded и _partial не пересекаются
+        return len(self._loaded) + len(self._partial)
+
+    def get_state(self, login: str) -> Optional[str]:
+        if self._recent is not None:
+            self._recent.refresh(login)
+        return self._states.get(login)
+
+    def set_state(self, login: str, state: Optional[str]) -> None:
+        if state is None:
+            if self._states.pop(login, None) is None:
+                return
+        elif self._states.get(login) == state:
+            return
+        else:
+            self._states[login] = state
+        self._touch(login)
+
+    def data(self, login: str) -> Dict[str, Any]:
+        found = self._datas.get(login)
+        if found is None:
+            found = self._datas[login] = {}
+        self._touch(login)
+        return found
+
+    def _touch(self, login: str) -> None:
+        if login not in self._loaded:
+            self._partial.add(login)
+        self._dirty.add(login)
+        if self._recent is not None:
+            due = self._recent.touch(login)
+            if due:
+                self._evict(due)
+
+    def needs_prefetch(self, login: str) -> bool:
+        return login not in self._loaded
+
+    async def prefetch(self, login: str) -> None:
+        """Подгружает пользователя из backend, если его ещё нет в кеше."""
+        if login in self._loaded:
+            return
+        record = await self.backend.load(login)
+        if login not in self._loaded:
+            self._merge(login, record)
+            if self._recent is not None:
+                due = self._recent.touch(login)
+                if due:
+                    self._evict(due)
+
+    def _merge(self, login: str, record: Optional[StateRecord]) -> None:
+        # то, что записали в память до чтения, важнее сохранённого
+        self._loaded.add(login)
+        self._partial.discard(login)
+        if record is None:
+            return
+        state, data = record
+        if state is not None and login not in self._states:
+            self._states[login] = state
+        if data:
+            current = self._datas.get(login)
+            if current is None:
+                self._datas[login] = data
+            else:
+                for key, value in data.items():
+                    current.setdefault(key, value)
+
+    def expire(self) -> int:
+        if self._recent is None:
+            return 0
+        due = self._recent.pop_due()
+        self._evict(due)
+        return len(due)
+
+    def pin(self, login: str) -> None:
+        if self._recent is not None:
+            self._recent.pin(login)
+
+    def unpin(self, login: str) -> None:
+        if self._recent is not None:
+            self._recent.unpin(login)
+
+    def _evict(self, logins: Sequence[str]) -> None:
+        for login in logins:
+            if login in self._dirty or login in self._partial:
+                self._evicting.add(login)
+            else:
+                self._drop(login)
+
+    def _drop(self, login: str) -> None:
+        state = self._states.pop(login, None)
+        data = self._datas.pop(login, None) or {}
+        self._loaded.discard(login)
+        self.evicted += 1
+        if self._on_evict is not None:
+            try:
+                self._on_evict(login, state, data)
+            except Exception as e:
+                self._log.exception("storage on_evict: {}", e)
+
+    def _record(self, login: str) -> StateRecord:
+        return self._states.get(login), self._datas.get(login) or {}
+
+    async def flush(self) -> None:
+        """Пишет изменённых пользователей одной пачкой и выпускает из памяти вытесненных. Ошибка backend — они остаются изменёнными до следующей попытки."""
+        if not self._dirty:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            logins, self._dirty = self._dirty, set()
+            if not logins:
+                return
+            try:
+                partial = [login for login in logins if login in self._partial]
+                if partial:
+                    found = await self.backend.load_many(partial)
+                    for login in partial:
+                        if login in self._partial:
+                            self._merge(login, found.get(login))
+                await self.backend.save({login: self._record(login) for login in logins})
+            except BaseException:
+                self._dirty |= logins
+                raise
+            evicting, self._evicting = self._evicting, set()
+            for login in evicting:
+                if self._recent is not None and login in self._recent:
+                    # к нему снова обратились — остаётся
+                    continue
+                if login in self._dirty or login in self._partial:
+                    self._evicting.add(login)
+                else:
+                    self._drop(login)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            try:
+                # idle_ttl срабатывает и без обращений: простоявшие вытесняются на каждом тике
+                self.expire()
+                await self.flush()
+            except Exception as e:
+                self._log.exception("storage flush: {}", e)
+
+    async def open(self) -> None:
+        await self.backend.open()
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def close(self) -> None:
+        """Последняя запись и закрытие backend. Кеш остаётся — после нового open() работа продолжается."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        try:
+            await self.flush()
+        finally:
+            await self.backend.close()
+
+
+class SQLiteBackend(AsyncStorage):
+    """Таблица bot_state (login, state, data) в файле SQLite. Все запросы — в одном своём потоке: event loop не ждёт диск, соединение не делится между потоками. data — JSON через codec."""
+
+    def __init__(
+        self, path: str, *, codec: Optional[JsonCodec] = None, table: str = "bot_state", log: Any = None
+    ) -> None:
+        if not table.isidentifier():
+            raise ValueError(f"bad table name {table!r}")
+        self.path = path
+        self._codec = codec or StdlibCodec()
+        self._log = log if log is not None else logger
+        self._table = table
+        self._conn: Optional[sqlite3.Connection] = None
+        self._thread: Optional[ThreadPoolExecutor] = None
+
+    async def _run(self, func: Any, *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._thread, func, *args)
+
+    def _connect(self) -> None:
+        conn = sqlite3.connect(self.path, timeout=30.0)
+        # WAL: чтение не ждёт запись; NORMAL — fsync на checkpoint, а не на каждую транзакцию
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self._table} (login TEXT PRIMARY KEY, state TEXT, data BLOB)"
+        )
+        conn.commit()
+        self._conn = conn
+
+    async def open(self) -> None:
+        if self._thread is None:
+            self._thread = ThreadPoolExecutor(1, thread_name_prefix="bot-storage")
+            await self._run(self._connect)
+
+    def _select(self, login: str) -> Optional[Tuple[Optional[str], Optional[bytes]]]:
+        return self._conn.execute(
+            f"SELECT state, data FROM {self._table} WHERE login = ?", (login,)
+        ).fetchone()
+
+    async def load(self, login: str) -> Optional[StateRecord]:
+        row = await self._run(self._select, login)
+        if row is None:
+            return None
+        state, blob = row
+        return state, self._codec.loads(blob) if blob else {}
+
+    def _select_many(self, logins: List[str]) -> List[Tuple[str, Optional[str], Optional[bytes]]]:
+        rows = []
+        # не больше 500 параметров в запросе — предел SQLite на старых сборках 999
+        for i in range(0, len(logins), 500):
+            chunk = logins[i:i + 500]
+            rows.extend(self._conn.execute(
+                f"SELECT login, state, data FROM {self._table} WHERE login IN ({','.join('?' * len(chunk))})",
+                chunk,
+            ))
+        return rows
+
+    async def load_many(self, logins: List[str]) -> Dict[str, StateRecord]:
+        rows = await self._run(self._select_many, logins)
+        return {login: (state, self._codec.loads(blob) if blob else {}) for login, state, blob in rows}
+
+    def _write(self, upserts: List[Tuple[str, Optional[str], bytes]], deletes: List[Tuple[str]]) -> None:
+        with self._conn:
+            if upserts:
+                self._conn.executemany(
+                    f"INSERT OR REPLACE INTO {self._table} (login, state, data) VALUES (?, ?, ?)", upserts
+                )
+            if deletes:
+                self._conn.executemany(f"DELETE FROM {self._table} WHERE login = ?", deletes)
+
+    async def save(self, records: Dict[str, StateRecord]) -> None:
+        # кодируем здесь, в loop: dict пользователя могут менять, пока поток пишет
+        upserts: List[Tuple[str, Optional[str], bytes]] = []
+        deletes: List[Tuple[str]] = []
+        for login, (state, data) in records.items():
+            if state is None and not data:
+                deletes.append((login,))
+                continue
+            try:
+                upserts.append((login, state, self._codec.dumps(data)))
+            except (TypeError, ValueError) as e:
+                # одно несериализуемое значение не должно держать всю пачку
+                self._log.error("storage: данные {} не сохранены: {}", login, e)
+        await self._run(self._write, upserts, deletes)
+
+    def _disconnect(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def close(self) -> None:
+        if self._thread is None:
+            return
+        await self._run(self._disconnect)
+        self._thread.shutdown(wait=True)
+        self._thread = None
+
+
+class SQLiteStorage(CachedStorage):
+    """FSM и Bot.state в файле SQLite с горячим кешем в памяти. flush_interval — как часто изменения уходят на диск (и при остановке бота). max_entries / idle_ttl — предел кеша: вытесненные остаются на диске. Значения в Bot.state должны сериализоваться в JSON."""
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        flush_interval: float = 1.0,
+        max_entries: Optional[int] = None,
+        idle_ttl: Optional[float] = None,
+        on_evict: Optional[OnEvict] = None,
+        codec: Optional[JsonCodec] = None,
+        log: Any = None,
+    ) -> None:
+        super().__init__(
+            SQLiteBackend(path, codec=codec, log=log),
+            flush_interval=flush_interval,
+            max_entries=max_entries,
+            idle_ttl=idle_ttl,
+            on_evict=on_evict,
+            log=log,
+        )
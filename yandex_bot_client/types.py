@@ -1,6 +1,16 @@
-"""Message и CallbackQuery — обёртки над update. В message_handler приходит Message, в button/callback_handler — CallbackQuery."""
+"""Message и CallbackQuery — обёртки над update. В message_handler приходит Message, в button/callback_handler — CallbackQuery. ParsedUpdate — update, разобранный один раз: его делят фильтры, диспетчер и события."""
 
-from typing import Any, Dict, Optional
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from .fsm import get_state
+
+if TYPE_CHECKING:
+    from .client import Bot
+
+_UNSET = object()
+
+# Сколько User держать в пуле бота: при переполнении вытесняется самый старый
+_USER_POOL_SIZE = 10000
 
 
 class User:
@@ -20,37 +30,166 @@ class User:
         return f"User(login={self.login!r})"
 
 
+class UserPool:
+    """Один User на login: повторные updates того же пользователя не создают объект заново. Поменялись поля в update["from"] — User пересобирается. Не больше capacity записей."""
+
+    __slots__ = ("_capacity", "_users")
+
+    def __init__(self, capacity: int = _USER_POOL_SIZE) -> None:
+        if capacity < 1:
+            raise ValueError("capacity must be >= 1")
+        self._capacity = capacity
+        self._users: Dict[str, User] = {}
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def get(self, login: str, data: Dict) -> User:
+        user = self._users.get(login)
+        if user is not None and (user._raw is data or user._raw == data):
+            return user
+        user = User(data)
+        if login not in self._users and len(self._users) >= self._capacity:
+            # dict хранит порядок вставки — первый ключ самый старый
+            del self._users[next(iter(self._users))]
+        self._users[login] = user
+        return user
+
+
+class ParsedUpdate:
+    """update, разобранный один раз: login, text (после strip), payload кнопки (None — текстовое сообщение). state, from_user и chat считаются при первом обращении; from_user берётся из пула бота."""
+
+    __slots__ = ("bot", "update", "login", "text", "payload", "_state", "_user")
+
+    def __init__(
+        self,
+        bot: Optional["Bot"],
+        update: Dict[str, Any],
+        login: Optional[str],
+        text: str,
+        payload: Optional[Dict[str, Any]] = None,
+        state: Any = _UNSET,
+    ) -> None:
+        self.bot = bot
+        self.update = update
+        self.login = login
+        self.text = text
+        self.payload = payload
+        self._state = state
+        self._user: Optional[User] = None
+
+    @classmethod
+    def from_update(cls, update: Dict[str, Any], payload: Optional[Dict[str, Any]] = None) -> "ParsedUpdate":
+        """Разбор вне диспетчера — для вызова фильтра вручную или события, созданного из dict. Бот — Bot.current()."""
+        from .client import Bot
+
+        user = update.get("from") if isinstance(update.get("from"), dict) else {}
+        login = user.get("login") if user else None
+        text = update.get("text")
+        return cls(Bot.current(), update, login, text.strip() if isinstance(text, str) else "", payload)
+
+    @property
+    def state(self) -> Optional[str]:
+        if self._state is _UNSET:
+            self._state = get_state(self.bot, self.login) if self.bot is not None and self.login else None
+        return self._state
+
+    @property
+    def from_user(self) -> User:
+        user = self._user
+        if user is None:
+            data = self.update.get("from")
+            if not isinstance(data, dict):
+                user = User(None)
+            elif self.bot is not None and self.login:
+                user = self.bot._users.get(self.login, data)
+            else:
+                user = User(data)
+            self._user = user
+        return user
+
+    @property
+    def chat(self) -> Optional[Dict]:
+        return self.update.get("chat")
+
+
 class Message:
-    """Текстовое сообщение. Атрибуты: text, message_id, from_user, chat, update_id, timestamp. raw — исходный update, если нужны поля вне типа."""
+    """Текстовое сообщение. Атрибуты: text, message_id, from_user, chat, update_id, timestamp. raw — исходный update, если нужны поля вне типа. parsed — общий ParsedUpdate."""
 
-    __slots__ = ("text", "message_id", "from_user", "chat", "update_id", "timestamp", "raw")
+    __slots__ = ("parsed", "raw", "text")
 
-    def __init__(self, update: Dict[str, Any]) -> None:
+    def __init__(self, update: Dict[str, Any], parsed: Optional[ParsedUpdate] = None) -> None:
+        if parsed is None:
+            parsed = ParsedUpdate.from_update(update)
+        self.parsed = parsed
         self.raw: Dict[str, Any] = update
-        self.text: str = (update.get("text") or "").strip()
-        self.message_id: Optional[int] = update.get("message_id")
-        self.from_user: User = User(update.get("from"))
-        self.chat: Optional[Dict] = update.get("chat")
-        self.update_id: Optional[int] = update.get("update_id")
-        self.timestamp: Optional[int] = update.get("timestamp")
+        self.text: str = parsed.text
+
+    @property
+    def from_user(self) -> User:
+        return self.parsed.from_user
+
+    @property
+    def chat(self) -> Optional[Dict]:
+        return self.raw.get("chat")
+
+    @property
+    def message_id(self) -> Optional[int]:
+        return self.raw.get("message_id")
+
+    @property
+    def update_id(self) -> Optional[int]:
+        return self.raw.get("update_id")
+
+    @property
+    def timestamp(self) -> Optional[int]:
+        return self.raw.get("timestamp")
+
+    def __reduce__(self) -> Any:
+        # в процесс-исполнитель уходит только update: бот из parsed не пересылается
+        return (Message, (self.raw,))
 
     def __repr__(self) -> str:
         return f"Message(text={self.text[:20]!r}...)" if len(self.text) > 20 else f"Message(text={self.text!r})"
 
 
 class CallbackQuery:
-    """Нажатие кнопки. from_user, payload (callback_data), data — то же что payload, message_id, update_id. raw_update / raw_payload — сырые dict."""
+    """Нажатие кнопки. from_user, payload (callback_data), data — то же что payload, message_id, update_id. raw_update / raw_payload — сырые dict. parsed — общий ParsedUpdate."""
 
-    __slots__ = ("from_user", "payload", "data", "message_id", "update_id", "raw_update", "raw_payload")
+    __slots__ = ("parsed", "raw_update", "payload")
 
-    def __init__(self, update: Dict[str, Any], payload: Dict[str, Any]) -> None:
+    def __init__(
+        self, update: Dict[str, Any], payload: Dict[str, Any], parsed: Optional[ParsedUpdate] = None
+    ) -> None:
+        if parsed is None:
+            parsed = ParsedUpdate.from_update(update, payload)
+        self.parsed = parsed
         self.raw_update: Dict[str, Any] = update
-        self.raw_payload: Dict[str, Any] = payload
-        self.from_user: User = User(update.get("from"))
         self.payload: Dict[str, Any] = payload
-        self.data: Dict[str, Any] = payload  # alias, как в aiogram
-        self.message_id: Optional[int] = update.get("message_id")
-        self.update_id: Optional[int] = update.get("update_id")
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        # alias, как в aiogram
+        return self.payload
+
+    @property
+    def raw_payload(self) -> Dict[str, Any]:
+        return self.payload
+
+    @property
+    def from_user(self) -> User:
+        return self.parsed.from_user
+
+    @property
+    def message_id(self) -> Optional[int]:
+        return self.raw_update.get("message_id")
+
+    @property
+    def update_id(self) -> Optional[int]:
+        return self.raw_update.get("update_id")
+
+    def __reduce__(self) -> Any:
+        return (CallbackQuery, (self.raw_update, self.payload))
 
     def __repr__(self) -> str:
         return f"CallbackQuery(payload={self.payload!r})"
@@ -0,0 +1,92 @@
+"""Webhook: aiohttp-сервер принимает updates пушем и отдаёт их в ту же диспетчеризацию, что и run(). Без опроса — нет пустых запросов к API в простое."""
+
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from aiohttp import web
+
+if TYPE_CHECKING:
+    from .client import Bot
+
+
+def _json_response(
+    bot: "Bot", data: Dict[str, Any], *, status: int = 200, headers: Optional[Dict[str, str]] = None
+) -> web.Response:
+    """Ответ отправителю webhook, сериализованный кодеком бота."""
+    return web.Response(
+        body=bot._codec.dumps(data), status=status, headers=headers, content_type="application/json"
+    )
+
+
+def extract_updates(body: Any) -> Optional[List[Dict]]:
+    """Тело запроса → список updates. Принимает {"updates": [...]}, [...] или один update. Невалидная структура — None."""
+    if isinstance(body, dict):
+        items = body.get("updates") if "updates" in body else [body]
+    elif isinstance(body, list):
+        items = body
+    else:
+        return None
+    if not isinstance(items, list):
+        return None
+    for u in items:
+        if not isinstance(u, dict) or not isinstance(u.get("update_id"), int):
+            return None
+    return items
+
+
+class WebhookIntake:
+    """Приём POST с updates. Приём бота заполнен (intake_size) — 503, отправитель повторит позже."""
+
+    def __init__(self, bot: "Bot") -> None:
+        self._bot = bot
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """POST с updates: валидирует, отдаёт в шарды целиком или не отдаёт ничего."""
+        bot = self._bot
+        try:
+            # из bytes сразу в кодек — без промежуточной str
+            body = bot._codec.loads(await request.read())
+        except (ValueError, UnicodeDecodeError):
+            return _json_response(bot, {"ok": False, "error": "invalid json"}, status=400)
+        updates = extract_updates(body)
+        if updates is None:
+            return _json_response(bot, {"ok": False, "error": "invalid updates"}, status=400)
+        # повторная доставка уже принятых updates — не ошибка, просто не берём их второй раз
+        updates = [u for u in updates if not bot._is_seen(u)]
+        dispatcher = bot._dispatcher
+        free = dispatcher.free if dispatcher is not None else 0
+        # пачку принимаем целиком, иначе при повторе отправителя часть updates обработается дважды
+        if free is not None and free < len(updates):
+            return _json_response(bot, {"ok": False, "error": "busy"}, status=503, headers={"Retry-After": "1"})
+        bot._journal_received(updates)
+        for u in updates:
+            if not bot._mark_seen(u):
+                continue
+            dispatcher.submit(u)
+        if bot._journal is not None:
+            # 200 — отправитель считает пачку доставленной: она должна быть на диске. Одновременные запросы пишутся одним commit
+            await bot._journal.commit()
+        return _json_response(bot, {"ok": True})
+
+    async def on_startup(self, app: web.Application) -> None:
+        self._bot._open_session()
+        await self._bot._start_intake()
+
+    async def on_cleanup(self, app: web.Application) -> None:
+        """Дожидается шардов до 10 с, дописывает журнал и закрывает сессию."""
+        await self._bot._stop_intake()
+        await self._bot._close_session()
+
+
+def build_app(
+    bot: "Bot",
+    path: str,
+    *,
+    max_body_size: int,
+) -> web.Application:
+    """aiohttp-приложение с одним POST-маршрутом path. Сессия к API и шарды поднимаются на старте приложения."""
+    intake = WebhookIntake(bot)
+    app = web.Application(client_max_size=max_body_size)
+    app.router.add_post(path, intake.handle)
+    app.on_startup.append(intake.on_startup)
+    app.on_cleanup.append(intake.on_cleanup)
+    return app